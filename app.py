@@ -1,18 +1,22 @@
 import os
 import time
-from cs50 import SQL
+import click
 from flask import Flask, flash, redirect, render_template, request, jsonify, url_for
-from flask_session import Session
 from werkzeug.security import check_password_hash, generate_password_hash
 from werkzeug.utils import secure_filename
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from datetime import datetime, timedelta, date
 import json
 import secrets
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from helpers import open_time_ranges, handle_profile_picture # Import custom functions from helpers.py
+from database import db
+from helpers import handle_profile_picture # Import custom functions from helpers.py
+from availability import rebuild_availability, check_availability
+from migrations import migrate, check_query_plans
+from query_stats import start_query_stats, stop_query_stats, current_query_stats, record_query
+from session_store import SqliteSessionInterface, prune_sessions
+from user_cache import cached_user, invalidate_user
+from mail_queue import Mailer, enqueue_mail, deliver_mail, start_mail_worker
+from data_transfer import TABLES, MIMETYPES, TransferError, export_table, import_table, transfer_format
 
 # Configure application
 app = Flask(__name__)
@@ -20,10 +24,42 @@ app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "123")
 app.config["UPLOAD_FOLDER"] = "static/uploads"
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)  
 app.config["SESSION_PERMANENT"] = False
-app.config["SESSION_TYPE"] = "filesystem"
-Session(app)
 
-db = SQL("sqlite:///database.db")   
+# Bring the database schema up to date
+migrate(db)
+
+# Sessions are stored in the database (see session_store.py)
+app.session_interface = SqliteSessionInterface(db)
+
+# Count and time the queries of every request (see query_stats.py); QUERY_STATS=0 turns it off
+app.config["QUERY_STATS"] = os.environ.get("QUERY_STATS", "1") == "1"
+if app.config["QUERY_STATS"]:
+    db.on_query = record_query
+
+    @app.before_request
+    def _start_query_stats():
+        start_query_stats()
+
+    @app.after_request
+    def _query_stats_header(response):
+        stats = current_query_stats()
+        if stats is not None:
+            response.headers["X-Query-Stats"] = stats.header()
+        return response
+
+    @app.teardown_request
+    def _log_query_stats(exception=None):
+        stats = stop_query_stats()
+        if stats is None:
+            return
+        app.logger.debug("%s %s: %s", request.method, request.path, stats.header())
+        for shape, count in stats.repeated():
+            app.logger.warning("%s ran the same query %d times: %s", request.endpoint, count, shape)
+
+# Send queued mail from a background thread; MAIL_WORKER=0 leaves it to `flask send-mail`
+app.config["MAIL_WORKER"] = os.environ.get("MAIL_WORKER", "1") == "1"
+if app.config["MAIL_WORKER"]:
+    start_mail_worker(db)
 
 # Initialize Flask-Login
 login_manager = LoginManager()
@@ -31,20 +67,7 @@ login_manager.init_app(app)
 login_manager.login_view = "login"
 
 def send_reset_email(to_email, reset_url):
-    # Send password reset email
-    
-    # Configure email settings
-    SMTP_SERVER = os.environ.get("SMTP_SERVER", "smtp.gmail.com")
-    SMTP_PORT = int(os.environ.get("SMTP_PORT", 587))
-    SMTP_USERNAME = os.environ.get("SMTP_USERNAME", "NEED TO SET")
-    SMTP_PASSWORD = os.environ.get("SMTP_PASSWORD", "NEED TO SET")
-    FROM_EMAIL = os.environ.get("FROM_EMAIL", "noreply@skiresort.com")
-    
-    # Create message
-    msg = MIMEMultipart()
-    msg['From'] = FROM_EMAIL
-    msg['To'] = to_email
-    msg['Subject'] = "Password Reset Request - Ski School"
+    # Queue the password reset email; the mail worker sends it (see mail_queue.py)
     
     # Email body
     body = f"""
@@ -62,18 +85,7 @@ def send_reset_email(to_email, reset_url):
     </html>
     """
     
-    msg.attach(MIMEText(body, 'html'))
-    
-    try:
-        # Connect to SMTP server and send email
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USERNAME, SMTP_PASSWORD)
-            server.send_message(msg)
-        return True
-    except Exception as e:
-        print(f"Error sending email: {e}")
-        return False
+    enqueue_mail(db, to_email, "Password Reset Request - Ski School", body)
         
 # Define User Model
 class User(UserMixin):
@@ -89,14 +101,20 @@ class User(UserMixin):
 def load_user(user_id):
     """Flask-Login callback to load user"""
     try:
-        user = db.execute("SELECT * FROM users WHERE id = ?", int(user_id))
-        if user:
-            return User(user[0]["id"], user[0]["username"], user[0]["role"])
-        return None  # Return None if no user found
+        user_id = int(user_id)
     # Handle case where user_id can't be converted to int
     except (ValueError, TypeError):
         return None
 
+    def load():
+        user = db.execute("SELECT id, username, role FROM users WHERE id = ?", user_id)
+        if user:
+            return User(user[0]["id"], user[0]["username"], user[0]["role"])
+        return None  # Return None if no user found
+
+    # Cached for USER_CACHE_TTL seconds (see user_cache.py)
+    return cached_user(user_id, load)
+
 # Add a custom filter for date formatting
 @app.template_filter('strftime')
 def _jinja2_filter_datetime(date, fmt=None):
@@ -262,6 +280,7 @@ def change_password():
     try:
         # Update password in database
         db.execute("UPDATE users SET hash = ? WHERE id = ?", new_hash, current_user.id)
+        invalidate_user(current_user.id)
         flash("Your password has been updated successfully!", "success")
     except Exception as e:
         print(f"Error updating password: {str(e)}", "danger")
@@ -376,6 +395,7 @@ def reset_password(token):
         
         # Update the user's password
         db.execute("UPDATE users SET hash = ? WHERE id = ?", password_hash, user_id)
+        invalidate_user(user_id)
         
         # Delete the used token
         db.execute("DELETE FROM password_reset_tokens WHERE token = ?", token)
@@ -458,6 +478,89 @@ def register():
         
     return render_template("register.html")
 
+########################### Command line ##################################
+
+@app.cli.command("rebuild-availability")
+@click.option("--check", is_flag=True, help="Only report instructor days that are out of date")
+def rebuild_availability_command(check):
+    """Recompute the availability table from time requests and lessons"""
+    if check:
+        stale = check_availability(db)
+        for instructor_id, day in stale:
+            click.echo(f"Out of date: instructor {instructor_id} on {day}")
+        click.echo(f"{len(stale)} instructor day(s) out of date")
+        if stale:
+            raise SystemExit(1)
+        return
+
+    count = rebuild_availability(db)
+    click.echo(f"Rebuilt availability for {count} instructor day(s)")
+
+@app.cli.command("check-query-plans")
+def check_query_plans_command():
+    """Fail if any query of the app reads a whole table instead of using an index"""
+    scans, skipped = check_query_plans(db, app.root_path)
+    for location, sql_error in skipped:
+        click.echo(f"Skipped {location}: {sql_error}")
+    for location, detail in scans:
+        click.echo(f"Full table scan at {location}: {detail}")
+    click.echo(f"{len(scans)} full table scan(s)")
+    if scans:
+        raise SystemExit(1)
+
+@app.cli.command("export-data")
+@click.argument("table", type=click.Choice(list(TABLES)))
+@click.option("--format", "fmt", type=click.Choice(list(MIMETYPES)), help="Defaults to the output file's extension, else csv")
+@click.option("--output", type=click.Path(dir_okay=False), default="-", help="File to write (default: standard output)")
+def export_data_command(table, fmt, output):
+    """Write every row of lessons or time_requests as CSV or NDJSON"""
+    fmt = fmt or transfer_format(output)
+    with click.open_file(output, "w", encoding="utf-8", newline="") as file:
+        for chunk in export_table(db, table, fmt):
+            file.write(chunk)
+
+@app.cli.command("import-data")
+@click.argument("table", type=click.Choice(list(TABLES)))
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(list(MIMETYPES)), help="Defaults to the file's extension, else csv")
+@click.option("--batch-size", type=click.IntRange(min=1), default=1000, help="Rows per executemany")
+def import_data_command(table, path, fmt, batch_size):
+    """Insert the rows of a CSV or NDJSON file into lessons or time_requests, all or nothing"""
+    with open(path, encoding="utf-8-sig", newline="") as file:
+        try:
+            count = import_table(db, table, file, fmt or transfer_format(path), batch_size)
+        except TransferError as e:
+            click.echo(f"Nothing was imported. {e}", err=True)
+            raise SystemExit(1)
+    click.echo(f"Imported {count} row(s) into {table}")
+
+@app.cli.command("send-mail")
+def send_mail_command():
+    """Send every queued email that is due, over one SMTP connection"""
+    mailer = Mailer()
+    claimed = 0
+    try:
+        while True:
+            batch = deliver_mail(db, mailer)
+            claimed += batch
+            if not batch:
+                break
+    finally:
+        mailer.close()
+    waiting = db.execute("SELECT COUNT(*) AS count FROM mail_queue WHERE status = 'pending'")[0]["count"]
+    click.echo(f"Processed {claimed} email(s), {waiting} waiting to be (re)tried")
+
+@app.cli.command("prune-sessions")
+def prune_sessions_command():
+    """Delete every expired session"""
+    deleted = 0
+    while True:
+        batch = prune_sessions(db)
+        deleted += batch
+        if not batch:
+            break
+    click.echo(f"Deleted {deleted} expired session(s)")
+
 ########################### Log-out route ##################################
 
 @app.route("/logout")
@@ -467,4 +570,4 @@ def logout():
     return redirect("/login")
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
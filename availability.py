@@ -0,0 +1,405 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+import os
+
+from cache import VersionedLRUCache
+from daygrid import booked_grid, inner_mask, is_free, open_grid, slot_starts, span_mask, to_ranges
+from days import to_day, to_iso
+from helpers import time_slots, time_slots_from_starts
+from intervals import iter_slots
+
+########################### Availability resolver ##################################
+
+# Loads a whole day (or range of days) for every instructor at once (one query per
+# table) instead of querying time_requests and lessons separately for each instructor.
+# Availability is kept as bitset day grids (see daygrid.py).
+
+def load_range_grids(db, first_date, last_date, instructor_id=None):
+    """Returns {date: {instructor_id: (open grid, booked grid)}} for every day from first_date to last_date"""
+
+    instructor_filter = "AND instructor_id = ?" if instructor_id is not None else ""
+    args = [to_day(first_date), to_day(last_date)]
+    if instructor_id is not None:
+        args.append(instructor_id)
+
+    # All approved requests for the range, in the order they were processed
+    time_requests = db.execute(
+        f"""
+        SELECT request_date, instructor_id, start_minute, end_minute, request_type
+        FROM time_requests
+        WHERE request_day BETWEEN ? AND ?
+        AND status = 'approved'
+        {instructor_filter}
+        ORDER BY processed_at, id
+        """,
+        *args
+    )
+
+    # All booked lessons for the range
+    lessons = db.execute(
+        f"""
+        SELECT lesson_date, instructor_id, start_minute, end_minute
+        FROM lessons
+        WHERE lesson_day BETWEEN ? AND ?
+        AND status = 'booked'
+        {instructor_filter}
+        """,
+        *args
+    )
+
+    # Group rows by day and instructor, keeping the processed_at order of the requests
+    requests_by_key = defaultdict(list)
+    for req in time_requests:
+        requests_by_key[(req["request_date"], req["instructor_id"])].append(req)
+
+    lessons_by_key = defaultdict(list)
+    for lesson in lessons:
+        lessons_by_key[(lesson["lesson_date"], lesson["instructor_id"])].append(lesson)
+
+    range_grids = defaultdict(dict)
+    for (day, instructor_id), requests in requests_by_key.items():
+        range_grids[day][instructor_id] = (open_grid(requests), booked_grid(lessons_by_key[(day, instructor_id)]))
+
+    return range_grids
+
+
+def load_day_grids(db, date, instructor_id=None):
+    """Returns {instructor_id: (open grid, booked grid)} for instructors with approved requests on date"""
+    return load_range_grids(db, date, date, instructor_id).get(date, {})
+
+
+def load_instructor_grids(db, date, instructor_id):
+    """Returns (open grid, booked grid) for one instructor on date"""
+    day_grids = load_day_grids(db, date, instructor_id)
+    return next(iter(day_grids.values()), (0, 0))
+
+
+def union_slot_starts(free_grids, duration, step, overrides=None):
+    """Grid of the cells where a slot of duration can start with any of the instructors
+
+    overrides maps instructor ids to their own (duration, step): instructors who teach
+    lessons of another length are left out, the others use their own step.
+    """
+    overrides = overrides or {}
+    starts = 0
+    for instructor_id, grid in free_grids.items():
+        instructor_duration, instructor_step = overrides.get(instructor_id, (duration, step))
+        if instructor_duration == duration:
+            starts |= slot_starts(grid, duration, instructor_step)
+    return starts
+
+
+def free_instructor_ids(free_grids, start, end):
+    """Returns the ids of instructors who are free for the whole of [start, end) (in minutes)"""
+    return {
+        instructor_id
+        for instructor_id, grid in free_grids.items()
+        if is_free(grid, start, end)
+    }
+
+
+########################### Materialized availability ##################################
+
+# The availability table keeps the net free ranges (open time minus booked lessons) of
+# every instructor per day, so reads are a single indexed lookup instead of replaying
+# the day's time_requests history. It is updated on every write that changes it:
+#   - new lessons only remove time (claim_availability)
+#   - processed time requests, cancelled lessons and deleted users are recomputed for
+#     that instructor and day from the source tables (refresh_availability_days)
+# Both run inside the transaction of the write that changes the source tables, so a
+# lesson booked meanwhile can't be overwritten; the caches are invalidated after it.
+# rebuild_availability recomputes everything, check_availability reports drift.
+# The table is created by the migrations (see migrations.py).
+
+def read_free_range(db, first_date, last_date, instructor_id=None):
+    """Returns {date: {instructor_id: grid of free cells}} from the availability table"""
+
+    instructor_filter = "AND instructor_id = ?" if instructor_id is not None else ""
+    args = [to_day(first_date), to_day(last_date)]
+    if instructor_id is not None:
+        args.append(instructor_id)
+
+    rows = db.execute(
+        f"""
+        SELECT available_day, instructor_id, start_minute, end_minute
+        FROM availability
+        WHERE available_day BETWEEN ? AND ?
+        {instructor_filter}
+        """,
+        *args
+    )
+
+    free_by_day = defaultdict(lambda: defaultdict(int))
+    for row in rows:
+        free_by_day[row["available_day"]][row["instructor_id"]] |= inner_mask(row["start_minute"], row["end_minute"])
+
+    # Keyed by 'YYYY-MM-DD' like the rest of the app, made once per day
+    free_range = defaultdict(lambda: defaultdict(int))
+    for day, grids in free_by_day.items():
+        free_range[to_iso(day)] = grids
+
+    return free_range
+
+
+def load_free_grids(db, date):
+    """Returns {instructor_id: grid of free cells} for every instructor with free time on date"""
+    return read_free_range(db, date, date).get(date, {})
+
+
+def load_instructor_free_grid(db, date, instructor_id):
+    """Returns the grid of free cells of one instructor on date"""
+    day_grids = read_free_range(db, date, date, instructor_id).get(date, {})
+    return next(iter(day_grids.values()), 0)
+
+
+def _write_free_grid(db, instructor_id, date, grid):
+    """Replaces the stored free ranges of one instructor on date (inside the caller's transaction)"""
+    ranges = to_ranges(grid)
+    day = to_day(date)
+
+    db.execute("DELETE FROM availability WHERE instructor_id = ? AND available_day = ?", instructor_id, day)
+
+    if ranges:
+        values = ", ".join(["(?, ?, ?, ?)"] * (len(ranges) // 2))
+        args = []
+        for i in range(0, len(ranges), 2):
+            args += [instructor_id, day, ranges[i], ranges[i + 1]]
+
+        db.execute(
+            f"INSERT INTO availability (instructor_id, available_day, start_minute, end_minute) VALUES {values}",
+            *args
+        )
+
+
+def claim_availability(db, instructor_id, date, start, end):
+    """Removes [start, end) (in minutes) from the stored free ranges inside the caller's transaction
+
+    Returns False and changes nothing if the instructor isn't free for all of it. The caller
+    invalidates the cache once the transaction has committed.
+    """
+    grid = load_instructor_free_grid(db, date, instructor_id)
+    if not is_free(grid, start, end):
+        return False
+    _write_free_grid(db, instructor_id, date, grid & ~span_mask(start, end))
+    return True
+
+
+def refresh_availability_days(db, keys):
+    """Recomputes the stored free ranges of every (instructor_id, date) in keys inside the caller's transaction
+
+    The source tables are read once for the whole range of dates. The caller invalidates
+    the cache of each key once the transaction has committed.
+    """
+    if not keys:
+        return
+    dates = sorted(date for _, date in keys)
+    range_grids = load_range_grids(db, dates[0], dates[-1])
+
+    for instructor_id, date in keys:
+        opened, booked = range_grids.get(date, {}).get(instructor_id, (0, 0))
+        _write_free_grid(db, instructor_id, date, opened & ~booked)
+
+
+def _computed_free_grids(db):
+    """Returns {(instructor_id, date): grid of free cells} computed from the source tables"""
+    computed = {}
+    for day, grids in load_range_grids(db, "0001-01-01", "9999-12-31").items():
+        for instructor_id, (opened, booked) in grids.items():
+            if opened & ~booked:
+                computed[(instructor_id, day)] = opened & ~booked
+    return computed
+
+
+def _stored_free_grids(db):
+    """Returns {(instructor_id, date): grid of free cells} from the availability table"""
+    stored = {}
+    for day, grids in read_free_range(db, "0001-01-01", "9999-12-31").items():
+        for instructor_id, grid in grids.items():
+            stored[(instructor_id, day)] = grid
+    return stored
+
+
+def refill_availability(db):
+    """Recomputes the whole availability table (inside the caller's transaction), returns the number of instructor days stored"""
+    computed = _computed_free_grids(db)
+
+    db.execute("DELETE FROM availability")
+    for (instructor_id, day), grid in computed.items():
+        _write_free_grid(db, instructor_id, day, grid)
+
+    availability_cache.clear()
+    return len(computed)
+
+
+def rebuild_availability(db):
+    """Recomputes the whole availability table, returns the number of instructor days stored"""
+    db.execute("BEGIN")
+    try:
+        count = refill_availability(db)
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+    finally:
+        availability_cache.clear()
+
+    return count
+
+
+def check_availability(db):
+    """Returns the sorted (instructor_id, date) keys where the stored free ranges are out of date"""
+    computed = _computed_free_grids(db)
+    stored = _stored_free_grids(db)
+
+    return sorted(
+        key for key in computed.keys() | stored.keys()
+        if computed.get(key, 0) != stored.get(key, 0)
+    )
+
+
+def find_next_slots(db, first_date, duration, step, k, instructor_id=None, not_before=0, max_days=180,
+                    skip_instructors=()):
+    """Returns the k earliest free slots from first_date on as (date, start, end, instructor_id), in minutes
+
+    Slots step from the start of each free range (like the per-day slot lists). Slots that
+    start before not_before (in minutes) on first_date are skipped, e.g. times already past today,
+    and so is the free time of skip_instructors.
+    """
+    instructor_filter = "AND instructor_id = ?" if instructor_id is not None else ""
+
+    # Nothing stored after this day, so there is no need to scan further
+    last_row = db.execute("SELECT MAX(available_day) AS last_day FROM availability")
+    if not last_row or last_row[0]["last_day"] is None:
+        return []
+
+    first_day = to_day(first_date)
+    last_day = min(first_day + max_days - 1, last_row[0]["last_day"])
+
+    found = []
+    window_start = first_day
+
+    # Scan a week at a time and stop as soon as k slots are found
+    while window_start <= last_day and len(found) < k:
+        window_end = min(window_start + 6, last_day)
+        args = [window_start, window_end, duration]
+        if instructor_id is not None:
+            args.append(instructor_id)
+
+        # Only ranges long enough for one slot
+        rows = db.execute(
+            f"""
+            SELECT available_day, instructor_id, start_minute, end_minute
+            FROM availability
+            WHERE available_day BETWEEN ? AND ?
+            AND end_minute - start_minute >= ?
+            {instructor_filter}
+            ORDER BY available_day, start_minute
+            """,
+            *args
+        )
+
+        rows_by_day = defaultdict(list)
+        for row in rows:
+            rows_by_day[row["available_day"]].append(row)
+
+        for day in sorted(rows_by_day):
+            # Ranges of different instructors interleave, so sort the day's slots before taking any
+            date = to_iso(day)
+            day_slots = []
+            for row in rows_by_day[day]:
+                if row["instructor_id"] in skip_instructors:
+                    continue
+                for start, end in iter_slots([row["start_minute"], row["end_minute"]], duration, step):
+                    if day == first_day and start < not_before:
+                        continue
+                    day_slots.append((date, start, end, row["instructor_id"]))
+
+            day_slots.sort(key=lambda slot: (slot[1], slot[3]))
+            found += day_slots[:k - len(found)]
+
+            if len(found) >= k:
+                break
+
+        window_start = window_end + 1
+
+    return found
+
+
+########################### Availability cache ##################################
+
+# Computed free time and slots are cached in-process per (instructor_id, date), with
+# (None, date) standing for "every instructor on date". Every change to the stored
+# availability bumps the version of both keys (see invalidate_availability), so this process
+# never serves a value after the data it was computed from has changed. The cache is per
+# process: changes made by other processes are seen when entries expire, after
+# AVAILABILITY_CACHE_TTL seconds, and paths that book lessons check the table directly.
+
+availability_cache = VersionedLRUCache(
+    max_entries=int(os.environ.get("AVAILABILITY_CACHE_SIZE", 4096)),
+    ttl=float(os.environ.get("AVAILABILITY_CACHE_TTL", 10))
+)
+
+
+def _instructor_key(instructor_id):
+    """Normalizes instructor ids from forms and query strings so they match database ids"""
+    try:
+        return int(instructor_id)
+    except (ValueError, TypeError):
+        return instructor_id
+
+
+def invalidate_availability(instructor_id, date):
+    """Bumps the cache version of one instructor's day and of the whole day"""
+    availability_cache.invalidate((_instructor_key(instructor_id), date))
+    availability_cache.invalidate((None, date))
+
+
+def cached_free_grids(db, date):
+    """Cached load_free_grids"""
+    return availability_cache.get_or_compute((None, date), lambda: load_free_grids(db, date), "free")
+
+
+def cached_instructor_free_grid(db, date, instructor_id):
+    """Cached load_instructor_free_grid"""
+    key = (_instructor_key(instructor_id), date)
+    return availability_cache.get_or_compute(key, lambda: load_instructor_free_grid(db, date, instructor_id), "free")
+
+
+def cached_day_slots(db, date, duration, step, overrides=None):
+    """Cached slots of every instructor on date as time_slots_from_starts label dicts, sorted by start time"""
+    overrides = overrides or {}
+    compute = lambda: time_slots_from_starts(union_slot_starts(cached_free_grids(db, date), duration, step, overrides), duration)
+    kind = ("slots", duration, step, tuple(sorted(overrides.items())))
+    return availability_cache.get_or_compute((None, date), compute, kind)
+
+
+def cached_instructor_slots(db, date, instructor_id, duration, step):
+    """Cached slots of one instructor on date as time_slots label dicts, sorted by start time"""
+    key = (_instructor_key(instructor_id), date)
+    compute = lambda: time_slots(to_ranges(cached_instructor_free_grid(db, date, instructor_id)), duration, step)
+    return availability_cache.get_or_compute(key, compute, ("slots", duration, step))
+
+
+def cached_range_slot_starts(db, first_date, last_date, duration, step, overrides=None, instructor_id=None):
+    """Cached {date: grid of cells where a slot can start} for every day from first_date to last_date
+
+    Days missing from the cache are read from the availability table in one query.
+    """
+    overrides = overrides or {}
+    instructor_key = _instructor_key(instructor_id) if instructor_id is not None else None
+
+    first = datetime.strptime(first_date, "%Y-%m-%d").date()
+    last = datetime.strptime(last_date, "%Y-%m-%d").date()
+    dates = [(first + timedelta(days=i)).strftime("%Y-%m-%d") for i in range((last - first).days + 1)]
+
+    def compute_missing(keys):
+        missing_dates = sorted(date for _, date in keys)
+        free_range = read_free_range(db, missing_dates[0], missing_dates[-1], instructor_id)
+        return {
+            (instructor_key, date): union_slot_starts(free_range.get(date, {}), duration, step, overrides)
+            for _, date in keys
+        }
+
+    kind = ("starts", duration, step, tuple(sorted(overrides.items())))
+    found = availability_cache.get_many_or_compute([(instructor_key, date) for date in dates], compute_missing, kind)
+    return {date: found[(instructor_key, date)] for date in dates}
@@ -0,0 +1,245 @@
+"""
+Benchmark and differential test of the availability engine.
+
+Generates synthetic time_requests histories, times the code that turns them into open
+time and bookable slots, and compares every result with a brute-force minute-by-minute
+(or cell-by-cell) reference. Prints the results as JSON and exits with status 1 if any
+result differs from the reference.
+
+Usage (from the project root):
+    python benchmarks/bench_availability.py
+    python benchmarks/bench_availability.py --scales 10 100 1000 --days 50 --output results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from daygrid import CELL_MINUTES, CELLS_PER_DAY, open_grid, slot_starts
+from helpers import time_slots, time_slots_from_starts
+from intervals import MINUTES_PER_DAY, contains, merge, open_time_ranges, pairs, to_minutes
+from availability import union_slot_starts
+
+PATTERNS = ["random", "opens_then_closes", "alternating", "nested", "fragmented"]
+
+# Slot settings to check (duration, step)
+SLOT_SETTINGS = [(60, 30), (90, 15), (120, 60)]
+
+
+########################### Synthetic histories ##################################
+
+def random_range(rng, granularity, min_length=None, max_length=None):
+    """Random [start, end) in minutes, on a grid of granularity minutes"""
+    min_length = min_length or granularity
+    max_length = max_length or MINUTES_PER_DAY
+    length = rng.randrange(min_length, max_length + 1, granularity)
+    start = rng.randrange(0, MINUTES_PER_DAY - length + 1, granularity)
+    return start, start + length
+
+
+def generate_day(rng, count, pattern):
+    """Returns count time requests in processed_at order, like the database query"""
+
+    # Mostly on the half hour like the forms, some on odd minutes to exercise rounding
+    granularity = rng.choice([30, 30, 15, 5, 1])
+    requests = []
+
+    for i in range(count):
+        if pattern == "opens_then_closes":
+            request_type = "open" if i < count // 2 else "close"
+        elif pattern == "alternating":
+            request_type = "open" if i % 2 == 0 else "close"
+        else:
+            request_type = rng.choice(["open", "open", "close"])
+
+        if pattern == "nested" and request_type == "close":
+            start, end = random_range(rng, granularity, max_length=120)
+        elif pattern == "fragmented":
+            start, end = random_range(rng, granularity, max_length=60)
+        else:
+            start, end = random_range(rng, granularity)
+
+        requests.append({
+            "start_minute": start,
+            "end_minute": end,
+            "request_type": request_type,
+            # Processing order differs from creation order
+            "processed_at": rng.randrange(count * 10)
+        })
+
+    requests.sort(key=lambda req: req["processed_at"])
+    return requests
+
+
+########################### Brute-force references ##################################
+
+def reference_open_minutes(time_requests):
+    """Open state of every minute of the day"""
+    minutes = [False] * MINUTES_PER_DAY
+    for req in time_requests:
+        start = req["start_minute"]
+        end = req["end_minute"]
+        for minute in range(start, end):
+            minutes[minute] = req["request_type"] == "open"
+    return minutes
+
+
+def reference_open_cells(time_requests):
+    """Open state of every cell: opened when fully inside an open request, closed when touched by a close"""
+    cells = [False] * CELLS_PER_DAY
+    for req in time_requests:
+        start = req["start_minute"]
+        end = req["end_minute"]
+        for cell in range(CELLS_PER_DAY):
+            cell_start = cell * CELL_MINUTES
+            cell_end = cell_start + CELL_MINUTES
+            if req["request_type"] == "open" and start <= cell_start and cell_end <= end:
+                cells[cell] = True
+            elif req["request_type"] == "close" and start < cell_end and cell_start < end:
+                cells[cell] = False
+    return cells
+
+
+def runs(states, unit):
+    """(start, end) in minutes of every run of True states of unit minutes each"""
+    result = []
+    run_start = None
+    for i, state in enumerate(states + [False]):
+        if state and run_start is None:
+            run_start = i
+        elif not state and run_start is not None:
+            result.append((run_start * unit, i * unit))
+            run_start = None
+    return result
+
+
+def reference_slots(free_runs, duration, step):
+    """(start, end) of every slot, stepping from the start of each free run"""
+    slots = []
+    for run_start, run_end in free_runs:
+        for slot_start in range(run_start, run_end - duration + 1, step):
+            slots.append((slot_start, slot_start + duration))
+    return slots
+
+
+def slot_pairs(slots):
+    """Slot dicts as (start, end) in minutes"""
+    return [(to_minutes(slot["start_time"]), to_minutes(slot["end_time"])) for slot in slots]
+
+
+########################### Benchmark ##################################
+
+def median_microseconds(function, inputs, repeat):
+    """Median time of one call of function over inputs, in microseconds"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for args in inputs:
+            function(*args)
+        timings.append((time.perf_counter() - started) / len(inputs))
+    return round(statistics.median(timings) * 1e6, 2)
+
+
+def run_scale(rng, requests_per_day, pattern, days, repeat):
+    """Times and checks the engine on days synthetic days, returns a result dict"""
+    histories = [generate_day(rng, requests_per_day, pattern) for _ in range(days)]
+    mismatches = []
+
+    ranges_by_day = [open_time_ranges(history) for history in histories]
+    grids_by_day = [open_grid(history) for history in histories]
+
+    for day, history in enumerate(histories):
+        minute_runs = runs(reference_open_minutes(history), 1)
+        cell_runs = runs(reference_open_cells(history), CELL_MINUTES)
+
+        if list(pairs(ranges_by_day[day])) != minute_runs:
+            mismatches.append({"day": day, "check": "open_time_ranges"})
+
+        if merge(minute_runs) != ranges_by_day[day]:
+            mismatches.append({"day": day, "check": "merge"})
+
+        if runs([grids_by_day[day] >> cell & 1 == 1 for cell in range(CELLS_PER_DAY)], CELL_MINUTES) != cell_runs:
+            mismatches.append({"day": day, "check": "open_grid"})
+
+        for duration, step in SLOT_SETTINGS:
+            minute_slots = reference_slots(minute_runs, duration, step)
+            if slot_pairs(time_slots(ranges_by_day[day], duration, step)) != minute_slots:
+                mismatches.append({"day": day, "check": f"time_slots {duration}/{step}"})
+
+            if not all(contains(ranges_by_day[day], start, end) for start, end in minute_slots):
+                mismatches.append({"day": day, "check": f"contains {duration}/{step}"})
+
+            # The grid engine rounds off-grid times to whole cells, so compare it with the cell reference
+            expected = sorted(set(reference_slots(cell_runs, duration, step)))
+            starts = slot_starts(grids_by_day[day], duration, step)
+            if slot_pairs(time_slots_from_starts(starts, duration)) != expected:
+                mismatches.append({"day": day, "check": f"slot_starts {duration}/{step}"})
+
+    # Union of the slots of every day, as if each day were one instructor on the same date
+    union_grids = dict(enumerate(grids_by_day))
+    expected_union = sorted({
+        slot
+        for history in histories
+        for slot in reference_slots(runs(reference_open_cells(history), CELL_MINUTES), 60, 30)
+    })
+    if slot_pairs(time_slots_from_starts(union_slot_starts(union_grids, 60, 30), 60)) != expected_union:
+        mismatches.append({"check": "union_slot_starts 60/30"})
+
+    return {
+        "requests_per_day": requests_per_day,
+        "pattern": pattern,
+        "days": days,
+        "timings_us": {
+            "open_time_ranges": median_microseconds(open_time_ranges, [(h,) for h in histories], repeat),
+            "open_grid": median_microseconds(open_grid, [(h,) for h in histories], repeat),
+            "time_slots": median_microseconds(time_slots, [(r, 60, 30) for r in ranges_by_day], repeat),
+            "slot_starts": median_microseconds(slot_starts, [(g, 60, 30) for g in grids_by_day], repeat),
+            "union_slot_starts": median_microseconds(union_slot_starts, [(union_grids, 60, 30)], repeat)
+        },
+        "mismatches": mismatches
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark and differential test of the availability engine")
+    parser.add_argument("--scales", type=int, nargs="+", default=[10, 100, 1000], help="requests per day")
+    parser.add_argument("--patterns", nargs="+", default=PATTERNS, choices=PATTERNS)
+    parser.add_argument("--days", type=int, default=20, help="synthetic days per scale and pattern")
+    parser.add_argument("--repeat", type=int, default=5, help="timing repetitions (the median is reported)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the JSON results to this file")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = [
+        run_scale(rng, requests_per_day, pattern, args.days, args.repeat)
+        for requests_per_day in args.scales
+        for pattern in args.patterns
+    ]
+    mismatch_count = sum(len(result["mismatches"]) for result in results)
+
+    report = {
+        "python": platform.python_version(),
+        "seed": args.seed,
+        "results": results,
+        "mismatches": mismatch_count
+    }
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+
+    sys.exit(1 if mismatch_count else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,24 @@
 from flask import Blueprint, render_template, request, redirect, flash, jsonify
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta, date
-from cs50 import SQL
 from werkzeug.security import generate_password_hash
 
 
-from helpers import open_time_ranges
+from database import db
+from helpers import schedule_grid
+from intervals import to_minutes, to_hhmm
+from days import to_day
+from daygrid import is_free
+from lesson_settings import get_lesson_settings, all_lesson_settings
+from booking import book_lesson, lesson_overlaps, BookingError
+from time_requests import process_time_requests, has_selection
+from user_search import search_users, in_rank_order
+from working_hours import get_working_hours
+from availability import (
+    load_instructor_free_grid, refresh_availability_days, invalidate_availability, availability_cache
+)
 
 admin_bp = Blueprint("admin_bp", __name__)
-db = SQL("sqlite:///database.db")
 
 ########################### Admin routes ##################################
 
@@ -36,10 +46,11 @@ def admin_home():
         FROM lessons l
         JOIN users c ON l.customer_id = c.id
         JOIN users i ON l.instructor_id = i.id
-        WHERE l.lesson_date >= CURRENT_DATE
-        ORDER BY l.lesson_date, l.start_time
+        WHERE l.lesson_day >= ?
+        ORDER BY l.lesson_day, l.start_minute
         LIMIT 10
-        """
+        """,
+        to_day(date.today())
     )
     
     pending_time_requests = db.execute(
@@ -55,7 +66,7 @@ def admin_home():
         FROM time_requests tr
         JOIN users u ON tr.instructor_id = u.id
         WHERE tr.status = 'pending'
-        ORDER BY tr.request_date, tr.start_time
+        ORDER BY tr.request_day, tr.start_minute
         LIMIT 10
         """
     )
@@ -105,10 +116,10 @@ def admin_home():
         FROM admin_schedules a
         JOIN users u ON a.admin_id = u.id
         JOIN user_info ui ON u.id = ui.id
-        WHERE a.work_date BETWEEN ? AND ?
-        ORDER BY a.work_date, a.start_time
+        WHERE a.work_day BETWEEN ? AND ?
+        ORDER BY a.work_day, a.start_minute
         """,
-        first_day.strftime("%Y-%m-%d"), last_day.strftime("%Y-%m-%d")
+        to_day(first_day), to_day(last_day)
     )
     
     # Get lessons for the month
@@ -125,36 +136,15 @@ def admin_home():
         FROM lessons l
         JOIN users c ON l.customer_id = c.id
         JOIN users i ON l.instructor_id = i.id
-        WHERE l.lesson_date BETWEEN ? AND ?
+        WHERE l.lesson_day BETWEEN ? AND ?
         AND l.status != 'cancelled'
-        ORDER BY l.lesson_date, l.start_time
+        ORDER BY l.lesson_day, l.start_minute
         """,
-        first_day.strftime("%Y-%m-%d"), last_day.strftime("%Y-%m-%d")
+        to_day(first_day), to_day(last_day)
     )
     
-    # Get working hours for each day of the week
-    working_hours = db.execute("SELECT * FROM working_hours ORDER BY day_of_week")
-    
-    # Create a dictionary for easier access in template
-    days_of_week = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
-    hours_by_day = {}
-    
-    for day in range(7):
-        hours_by_day[day] = {
-            "name": days_of_week[day],
-            "open_time": "09:00",
-            "close_time": "17:00",
-            "is_open": True
-        }
-    
-    for hours in working_hours:
-        day = hours["day_of_week"]
-        hours_by_day[day] = {
-            "name": days_of_week[day],
-            "open_time": hours["open_time"],
-            "close_time": hours["close_time"],
-            "is_open": hours["is_open"]
-        }
+    # Working hours of every day of the week, with defaults for days that aren't set
+    hours_by_day = get_working_hours(db).hours_by_day()
     
     # Get current month for calendar
     current_month = today.strftime("%B %Y")
@@ -209,10 +199,10 @@ def get_my_calendar():
             start_time,
             end_time
         FROM admin_schedules
-        WHERE admin_id = ? AND work_date BETWEEN ? AND ?
-        ORDER BY work_date, start_time
+        WHERE admin_id = ? AND work_day BETWEEN ? AND ?
+        ORDER BY work_day, start_minute
         """,
-        current_user.id, first_day.strftime("%Y-%m-%d"), last_day.strftime("%Y-%m-%d")
+        current_user.id, to_day(first_day), to_day(last_day)
     )
     
     # Get schedules for all admins for the month (to show who else is working)
@@ -227,10 +217,10 @@ def get_my_calendar():
             a.end_time
         FROM admin_schedules a
         JOIN users u ON a.admin_id = u.id
-        WHERE a.work_date BETWEEN ? AND ?
-        ORDER BY a.work_date, a.start_time
+        WHERE a.work_day BETWEEN ? AND ?
+        ORDER BY a.work_day, a.start_minute
         """,
-        first_day.strftime("%Y-%m-%d"), last_day.strftime("%Y-%m-%d")
+        to_day(first_day), to_day(last_day)
     )
     
     # Get lessons for the month
@@ -247,26 +237,15 @@ def get_my_calendar():
         FROM lessons l
         JOIN users c ON l.customer_id = c.id
         JOIN users i ON l.instructor_id = i.id
-        WHERE l.lesson_date BETWEEN ? AND ?
+        WHERE l.lesson_day BETWEEN ? AND ?
         AND l.status != 'cancelled'
-        ORDER BY l.lesson_date, l.start_time
+        ORDER BY l.lesson_day, l.start_minute
         """,
-        first_day.strftime("%Y-%m-%d"), last_day.strftime("%Y-%m-%d")
+        to_day(first_day), to_day(last_day)
     )
     
-    # Get working hours for each day of the week
-    working_hours = db.execute("SELECT * FROM working_hours ORDER BY day_of_week")
-    
-    # Create a dictionary for easier access in the frontend
-    hours_by_day = {}
-    
-    for hours in working_hours:
-        day = hours["day_of_week"]
-        hours_by_day[day] = {
-            "open_time": hours["open_time"],
-            "close_time": hours["close_time"],
-            "is_open": hours["is_open"]
-        }
+    # Working hours of the days that are set, for the frontend
+    hours_by_day = get_working_hours(db).configured_hours()
     
     # Return the data as JSON
     return jsonify({
@@ -304,17 +283,37 @@ def admin_time_requests():
             flash("Invalid action", "danger")
             return redirect("/admin/manage_time_requests")
         
-        # Update the request status
         status = "approved" if action == "approve" else "rejected"
         
-        db.execute(
-            """
-            UPDATE time_requests
-            SET status = ?, admin_id = ?, processed_at = CURRENT_TIMESTAMP, admin_note = ?
-            WHERE id = ?
-            """,
-            status, current_user.id, admin_note, request_id
-        )
+        # The status and the instructor's stored availability for that day change together
+        with db.transaction("IMMEDIATE"):
+            time_request = db.execute(
+                "SELECT instructor_id, request_date, status FROM time_requests WHERE id = ?",
+                request_id
+            )
+            
+            if not time_request:
+                flash("Invalid request", "danger")
+                return redirect("/admin/manage_time_requests")
+            
+            time_request = time_request[0]
+            
+            db.execute(
+                """
+                UPDATE time_requests
+                SET status = ?, admin_id = ?, processed_at = CURRENT_TIMESTAMP, admin_note = ?
+                WHERE id = ?
+                """,
+                status, current_user.id, admin_note, request_id
+            )
+            
+            # Only approved requests count towards the instructor's open time
+            changed = status == "approved" or time_request["status"] == "approved"
+            if changed:
+                refresh_availability_days(db, [(time_request["instructor_id"], time_request["request_date"])])
+        
+        if changed:
+            invalidate_availability(time_request["instructor_id"], time_request["request_date"])
         
         flash(f"Time request {status}", "success")
         return redirect("/admin/manage_time_requests")
@@ -338,7 +337,7 @@ def admin_time_requests():
         JOIN users ON time_requests.instructor_id = users.id
         JOIN user_info ON users.id = user_info.id
         WHERE time_requests.status = 'pending'
-        ORDER BY time_requests.request_date, time_requests.start_time
+        ORDER BY time_requests.request_day, time_requests.start_minute
         """
     )
     
@@ -362,7 +361,7 @@ def admin_time_requests():
         JOIN users ON time_requests.instructor_id = users.id
         JOIN user_info ON users.id = user_info.id
         WHERE time_requests.status IN ('approved', 'rejected')
-        ORDER BY time_requests.processed_at DESC
+        ORDER BY time_requests.processed_at DESC, time_requests.id DESC
         LIMIT 20
         """
     )
@@ -373,6 +372,62 @@ def admin_time_requests():
         processed_requests=processed_requests
     )
 
+@admin_bp.route("/bulk_time_requests", methods=["POST"])
+@login_required
+def admin_bulk_time_requests():
+    """Approve or reject many pending time requests at once"""
+    
+    # Ensure the current user is an admin or owner
+    if current_user.role not in ["admin", "owner"]:
+        flash("You don't have permission to access this page", "danger")
+        return redirect("/")
+    
+    action = request.form.get("action")
+    admin_note = request.form.get("admin_note", "")
+    
+    if action not in ["approve", "reject"]:
+        flash("Invalid action", "danger")
+        return redirect("/admin/manage_time_requests")
+    
+    # The selected requests, or without a selection every pending request matching the filter
+    request_ids = request.form.getlist("request_ids") or None
+    request_type = request.form.get("request_type") or None
+    if request_type not in [None, "open", "close"]:
+        flash("Invalid request type", "danger")
+        return redirect("/admin/manage_time_requests")
+    
+    instructor_id = request.form.get("instructor_id")
+    first_date = request.form.get("start_date")
+    last_date = request.form.get("end_date")
+    
+    # Every pending request only when asked for explicitly, never from an empty form
+    process_all = request.form.get("process_all") == "1"
+    if not process_all and not has_selection(request_ids, instructor_id, first_date, last_date, request_type):
+        flash("Select requests, set a filter or tick \"All pending requests\"", "danger")
+        return redirect("/admin/manage_time_requests")
+    
+    status = "approved" if action == "approve" else "rejected"
+    
+    try:
+        count = process_time_requests(
+            db, status, current_user.id, admin_note,
+            request_ids=request_ids,
+            instructor_id=instructor_id,
+            first_date=first_date,
+            last_date=last_date,
+            request_type=request_type,
+            process_all=process_all
+        )
+    except ValueError:
+        flash("Invalid date", "danger")
+        return redirect("/admin/manage_time_requests")
+    
+    if count:
+        flash(f"{count} time request{'s' if count != 1 else ''} {status}", "success")
+    else:
+        flash("No pending time requests matched", "warning")
+    return redirect("/admin/manage_time_requests")
+
 @admin_bp.route("/instructor_schedule", methods=["GET"])
 @login_required
 def admin_instructor_schedule():
@@ -398,39 +453,19 @@ def admin_instructor_schedule():
     formatted_date = selected_date.strftime("%A, %B %d, %Y")
     
     # Get working hours for the day of week
-    day_of_week = selected_date.weekday()  # 0 = Monday, 6 = Sunday
+    open_hours = get_working_hours(db).open_minutes(selected_date)
     
-    # Query the working hours for this day
-    db_working_hours = db.execute(
-        "SELECT * FROM working_hours WHERE day_of_week = ? AND is_open = 1", 
-        day_of_week
-    )
-    
-    if not db_working_hours:
+    if open_hours is None:
         # Return a message that the school is closed
         return render_template("admin/instructor_schedule.html", 
             selected_date=selected_date.strftime("%Y-%m-%d"),
             formatted_date=formatted_date,
             is_open=False)
     
-    working_hours = db_working_hours[0]
-    
-    # Generate time slots in 30-minute intervals
-    start_hour, start_minute = map(int, working_hours["open_time"].split(":"))
-    end_hour, end_minute = map(int, working_hours["close_time"].split(":"))
-    
-    start_minutes = start_hour * 60 + start_minute
-    end_minutes = end_hour * 60 + end_minute
-    
-    time_slots = []
-    current_minutes = start_minutes
-    
-    while current_minutes < end_minutes:
-        hour = current_minutes // 60
-        minute = current_minutes % 60
-        time_slot = f"{hour:02d}:{minute:02d}"
-        time_slots.append(time_slot)
-        current_minutes += 30
+    # Time slots in 30-minute intervals
+    start_minutes, end_minutes = open_hours
+    slot_count = max(0, -(-(end_minutes - start_minutes) // 30))
+    time_slots = [to_hhmm(start_minutes + i * 30) for i in range(slot_count)]
     
     # Get all instructors
     instructors = db.execute(
@@ -440,70 +475,34 @@ def admin_instructor_schedule():
         "ORDER BY user_info.surname, user_info.name"
     )
     
-    # Get all approved time requests (openings and closings) for the selected date
+    # Get all approved time requests (openings and closings) for the selected date, in the order they were processed
     time_requests = db.execute(
-        "SELECT instructor_id, start_time, end_time, request_type "
+        "SELECT instructor_id, start_minute, end_minute, request_type "
         "FROM time_requests "
-        "WHERE request_date = ? AND status = 'approved'",
-        selected_date.strftime("%Y-%m-%d")
+        "WHERE request_day = ? AND status = 'approved' "
+        "ORDER BY processed_at, id",
+        to_day(selected_date)
     )
     
-    # Create a dictionary to track instructor availability
-    instructor_availability = {}
-    
-    for instructor in instructors:
-        instructor_id = instructor["id"]
-        instructor_availability[instructor_id] = {}
-        
-        # Initialize all time slots as closed
-        for time_slot in time_slots:
-            instructor_availability[instructor_id][time_slot] = {
-                "status": "closed",
-                "lesson": None
-            }
-        
-        # Process time requests to update availability
-        for req in time_requests:
-            if req["instructor_id"] == instructor_id:
-                req_start = req["start_time"]
-                req_end = req["end_time"]
-                req_type = req["request_type"]
-                
-                # Update all time slots affected by this request
-                for time_slot in time_slots:
-                    if req_start <= time_slot < req_end:
-                        if req_type == "open":
-                            instructor_availability[instructor_id][time_slot]["status"] = "open"
-                        elif req_type == "close":
-                            instructor_availability[instructor_id][time_slot]["status"] = "closed"
-    
     # Get all lessons for the selected date
     lessons = db.execute(
         """
-        SELECT l.id, l.instructor_id, l.start_time, l.end_time, l.status, l.notes,
+        SELECT l.id, l.instructor_id, l.start_time, l.end_time, l.start_minute, l.end_minute, l.status, l.notes,
                u.id as customer_id, ui.name as customer_first_name, ui.surname as customer_last_name,
                ui.email as customer_email, ui.phone as customer_phone, ui.birthday as customer_birthday,
                ui.ski_type as customer_ski_type
         FROM lessons l
         JOIN users u ON l.customer_id = u.id
         JOIN user_info ui ON u.id = ui.id
-        WHERE l.lesson_date = ? AND l.status = 'booked'
+        WHERE l.lesson_day = ? AND l.status = 'booked'
         """,
-        selected_date.strftime("%Y-%m-%d")
+        to_day(selected_date)
     )
     
-    # Update availability with lessons
-    for lesson in lessons:
-        instructor_id = lesson["instructor_id"]
-        start_time = lesson["start_time"]
-        end_time = lesson["end_time"]
-        
-        # Add lesson to all time slots it covers
-        for time_slot in time_slots:
-            if start_time <= time_slot < end_time:
-                if instructor_id in instructor_availability:
-                    instructor_availability[instructor_id][time_slot]["status"] = "booked"
-                    instructor_availability[instructor_id][time_slot]["lesson"] = lesson
+    # Status of every instructor in every time slot
+    instructor_availability = schedule_grid(
+        [instructor["id"] for instructor in instructors], start_minutes, slot_count, time_requests, lessons
+    )
     
     # Format lessons for JSON serialization
     lessons_json = []
@@ -512,6 +511,13 @@ def admin_instructor_schedule():
         # Convert any non-serializable data types if needed
         lessons_json.append(lesson_dict)
     
+    # Lesson length of every instructor, for the add lesson form
+    school_settings, instructor_settings = all_lesson_settings(db)
+    lesson_durations = {
+        instructor["id"]: instructor_settings.get(instructor["id"], school_settings)[0]
+        for instructor in instructors
+    }
+    
     return render_template("admin/instructor_schedule.html",
         selected_date=selected_date.strftime("%Y-%m-%d"),
         formatted_date=formatted_date,
@@ -519,6 +525,7 @@ def admin_instructor_schedule():
         instructors=instructors,
         instructor_availability=instructor_availability,
         lessons=lessons_json,
+        lesson_durations=lesson_durations,
         is_open=True)
 
 @admin_bp.route("/search_customers", methods=["GET"])
@@ -535,26 +542,21 @@ def search_customers():
     if not query or len(query) < 2:
         return jsonify({"success": True, "customers": []})
     
-    # Search for customers
+    # Search for customers, best matches first
+    customer_ids = search_users(db, query, ["customer"], ["name", "surname", "email", "phone"], limit=10)
+    if not customer_ids:
+        return jsonify({"success": True, "customers": []})
+    
     customers = db.execute(
-        """
-        SELECT u.id, ui.name, ui.surname, ui.email, ui.phone, ui.birthday, ui.ski_type
-        FROM users u
-        JOIN user_info ui ON u.id = ui.id
-        WHERE u.role = 'customer' 
-        AND (
-            ui.name LIKE ? OR 
-            ui.surname LIKE ? OR 
-            ui.email LIKE ? OR 
-            ui.phone LIKE ?
-        )
-        ORDER BY ui.surname, ui.name
-        LIMIT 10
+        f"""
+        SELECT ui.id, ui.name, ui.surname, ui.email, ui.phone, ui.birthday, ui.ski_type
+        FROM user_info ui
+        WHERE ui.id IN ({", ".join(["?"] * len(customer_ids))})
         """,
-        f"%{query}%", f"%{query}%", f"%{query}%", f"%{query}%"
+        *customer_ids
     )
     
-    return jsonify({"success": True, "customers": customers})
+    return jsonify({"success": True, "customers": in_rank_order(customers, customer_ids)})
 
 @admin_bp.route("/add_lesson", methods=["POST"])
 @login_required
@@ -571,52 +573,22 @@ def admin_add_lesson():
     notes = request.form.get("notes", "")
     user_type = request.form.get("user_type")
     
-    # Fixed duration of 60 minutes
-    duration = 60
+    # Lesson length of the instructor (or the school-wide one)
+    duration, _ = get_lesson_settings(db, instructor_id)
     
     # Calculate end time (start_time + duration)
-    start_hour, start_minute = map(int, start_time.split(":"))
-    start_minutes = start_hour * 60 + start_minute
+    start_minutes = to_minutes(start_time)
     end_minutes = start_minutes + duration
-    end_hour = end_minutes // 60
-    end_minute = end_minutes % 60
-    end_time = f"{end_hour:02d}:{end_minute:02d}"
     
     try:
-        # Check if the instructor is available for this time slot
-        # Get all approved time requests for this instructor on this date
-        time_requests = db.execute(
-            """
-            SELECT start_time, end_time, request_type
-            FROM time_requests
-            WHERE instructor_id = ? AND request_date = ? AND status = 'approved'
-            """,
-            instructor_id, lesson_date
-        )
-        
-        # Check if the instructor is available for the entire duration
-        is_available = False
-        for req in time_requests:
-            if req["request_type"] == "open" and req["start_time"] <= start_time and end_time <= req["end_time"]:
-                is_available = True
-                break
-        
-        if not is_available:
-            return jsonify({"success": False, "message": "Instructor is not available for this time slot"}), 400
-        
         # Check if there are any overlapping lessons
-        existing_lessons = db.execute(
-            """
-            SELECT id FROM lessons
-            WHERE instructor_id = ? AND lesson_date = ? AND status = 'booked'
-            AND ((start_time <= ? AND end_time > ?) OR (start_time < ? AND end_time >= ?) OR (start_time >= ? AND end_time <= ?))
-            """,
-            instructor_id, lesson_date, start_time, start_time, end_time, end_time, start_time, end_time
-        )
-        
-        if existing_lessons:
+        if lesson_overlaps(db, instructor_id, lesson_date, start_minutes, end_minutes):
             return jsonify({"success": False, "message": "There is already a lesson booked during this time"}), 400
         
+        # Check if the instructor is free for the entire duration
+        if not is_free(load_instructor_free_grid(db, lesson_date, instructor_id), start_minutes, end_minutes):
+            return jsonify({"success": False, "message": "Instructor is not available for this time slot"}), 400
+        
         # Handle customer based on user_type
         customer_id = None
         
@@ -681,14 +653,12 @@ def admin_add_lesson():
         else:
             return jsonify({"success": False, "message": "Invalid user type"}), 400
         
-        # Insert the new lesson
-        lesson_id = db.execute(
-            """
-            INSERT INTO lessons (instructor_id, customer_id, lesson_date, start_time, end_time, status, notes, created_at)
-            VALUES (?, ?, ?, ?, ?, 'booked', ?, datetime('now'))
-            """,
-            instructor_id, customer_id, lesson_date, start_time, end_time, notes
-        )
+        # Book the lesson; the checks above are repeated in the booking transaction in case
+        # someone else booked the time meanwhile
+        try:
+            lesson_id = book_lesson(db, instructor_id, customer_id, lesson_date, start_minutes, end_minutes, notes)
+        except BookingError as e:
+            return jsonify({"success": False, "message": str(e)}), 400
         
         # Get the newly created lesson details
         new_lesson = db.execute(
@@ -713,3 +683,14 @@ def admin_add_lesson():
         
     except Exception as e:
         return jsonify({"success": False, "message": f"Error: {str(e)}"}), 500
+
+@admin_bp.route("/availability_cache_stats", methods=["GET"])
+@login_required
+def availability_cache_stats():
+    """API endpoint with the hit/miss counters of the availability cache"""
+    
+    # Ensure the current user is an admin or owner
+    if current_user.role != "admin" and current_user.role != "owner":
+        return jsonify({"error": "Unauthorized"}), 403
+    
+    return jsonify(availability_cache.stats())
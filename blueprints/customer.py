@@ -1,12 +1,19 @@
 from flask import Blueprint, render_template, request, redirect, flash, jsonify
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta, date
-from cs50 import SQL
 
-from helpers import open_time_ranges
+from database import db
+from intervals import to_minutes, to_hhmm, to_display
+from days import to_day, to_date
+from daygrid import CELL_MINUTES
+from lesson_settings import get_lesson_settings, all_lesson_settings, valid_lesson_settings
+from booking import book_lesson, BookingError
+from availability import (
+    free_instructor_ids, refresh_availability_days, invalidate_availability, cached_free_grids, cached_day_slots,
+    cached_instructor_slots, cached_range_slot_starts, find_next_slots
+)
 
 customer_bp = Blueprint("customer_bp", __name__)
-db = SQL("sqlite:///database.db")
 
 ########################### Customer routes ##################################
 
@@ -64,72 +71,13 @@ def customer_book_lesson():
             flash("Invalid instructor selected", "danger")
             return redirect("/customer/book_lesson")
         
-        # Check if the instructor has an approved open time slot for this date and time
-        # Get all approved time requests for this instructor on this date
-        time_requests = db.execute(
-            """
-            SELECT 
-                request_date, 
-                start_time, 
-                end_time,
-                request_type,
-                processed_at
-            FROM time_requests 
-            WHERE instructor_id = ? 
-            AND status = 'approved'
-            AND request_date = ?
-            ORDER BY processed_at
-            """,
-            instructor_id, date
-        )
-        
-        # Process time requests to determine if the requested time is available
-        open_ranges = open_time_ranges(time_requests)
-        
-        # Check if the requested time slot is within an open range
-        is_available = False
-        for open_range in open_ranges:
-            if start_time_obj >= open_range["start"] and end_time_obj <= open_range["end"]:
-                is_available = True
-                break
-        
-        if not is_available:
-            flash("The selected instructor is not available at this time", "danger")
-            return redirect("/customer/book_lesson")
-        
-        # Check if the instructor already has a lesson booked for this time
-        existing_lessons = db.execute(
-            """
-            SELECT id FROM lessons
-            WHERE instructor_id = ?
-            AND lesson_date = ?
-            AND status = 'booked'
-            AND (
-                (start_time <= ? AND end_time > ?) OR
-                (start_time < ? AND end_time >= ?) OR
-                (start_time >= ? AND end_time <= ?)
-            )
-            """,
-            instructor_id, date,
-            start_time, start_time,
-            end_time, end_time,
-            start_time, end_time
-        )
-        
-        if existing_lessons:
-            flash("The instructor already has a lesson booked for this time", "danger")
+        # Book the lesson if the instructor is free for all of it (checked and booked in one transaction)
+        try:
+            book_lesson(db, instructor_id, current_user.id, date, to_minutes(start_time), to_minutes(end_time), notes)
+        except BookingError as e:
+            flash(str(e), "danger")
             return redirect("/customer/book_lesson")
         
-        # Book the lesson
-        db.execute(
-            """
-            INSERT INTO lessons
-            (customer_id, instructor_id, lesson_date, start_time, end_time, notes, status, created_at)
-            VALUES (?, ?, ?, ?, ?, ?, 'booked', datetime('now'))
-            """,
-            current_user.id, instructor_id, date, start_time, end_time, notes
-        )
-        
         flash("Lesson booked successfully", "success")
         return redirect("/customer/my_lessons")
     
@@ -168,123 +116,10 @@ def get_available_times_for_date():
     if not date:
         return jsonify({"error": "Missing date parameter"}), 400
     
-    # Get all instructors with open time requests for this date
-    instructors_with_open_times = db.execute(
-        """
-        SELECT DISTINCT instructor_id
-        FROM time_requests
-        WHERE request_date = ?
-        AND status = 'approved'
-        AND request_type = 'open'
-        """,
-        date
-    )
-    
-    # For each instructor, get their available time slots
-    all_available_times = []
-    
-    for instructor in instructors_with_open_times:
-        instructor_id = instructor["instructor_id"]
-        
-        # Get all approved time requests for this instructor on this date
-        time_requests = db.execute(
-            """
-            SELECT 
-                start_time, 
-                end_time,
-                request_type,
-                processed_at
-            FROM time_requests 
-            WHERE instructor_id = ? 
-            AND status = 'approved'
-            AND request_date = ?
-            ORDER BY processed_at
-            """,
-            instructor_id, date
-        )
-        
-        # Get open time ranges from the requests
-        open_ranges = open_time_ranges(time_requests)
-        
-        # Get existing lessons for this instructor on this date
-        existing_lessons = db.execute(
-            """
-            SELECT start_time, end_time
-            FROM lessons
-            WHERE instructor_id = ?
-            AND lesson_date = ?
-            AND status = 'booked'
-            ORDER BY start_time
-            """,
-            instructor_id, date
-        )
-        
-        # Remove times that are already booked
-        for lesson in existing_lessons:
-            lesson_start = datetime.strptime(lesson["start_time"], "%H:%M").time()
-            lesson_end = datetime.strptime(lesson["end_time"], "%H:%M").time()
-            
-            updated_ranges = []
-            
-            for open_range in open_ranges:
-                # Case 1: Lesson completely covers open range - skip this open range
-                if lesson_start <= open_range["start"] and lesson_end >= open_range["end"]:
-                    continue
-                
-                # Case 2: Lesson is completely within open range - split into two
-                elif lesson_start > open_range["start"] and lesson_end < open_range["end"]:
-                    updated_ranges.append({"start": open_range["start"], "end": lesson_start})
-                    updated_ranges.append({"start": lesson_end, "end": open_range["end"]})
-                
-                # Case 3: Lesson overlaps with start of open range
-                elif lesson_start <= open_range["start"] and lesson_end > open_range["start"] and lesson_end < open_range["end"]:
-                    updated_ranges.append({"start": lesson_end, "end": open_range["end"]})
-                
-                # Case 4: Lesson overlaps with end of open range
-                elif lesson_start > open_range["start"] and lesson_start < open_range["end"] and lesson_end >= open_range["end"]:
-                    updated_ranges.append({"start": open_range["start"], "end": lesson_start})
-                
-                # Case 5: No overlap - keep the open range as is
-                else:
-                    updated_ranges.append(open_range)
-            
-            # Replace the open ranges with the updated ones
-            open_ranges = updated_ranges
-        
-        # Create 1-hour slots within each open range
-        for open_range in open_ranges:
-            start = open_range["start"]
-            end = open_range["end"]
-            
-            # Convert to datetime for easier arithmetic
-            start_dt = datetime.combine(datetime.today(), start)
-            end_dt = datetime.combine(datetime.today(), end)
-            
-            # Create 1-hour slots
-            current = start_dt
-            while current + timedelta(hours=1) <= end_dt:
-                slot_start = current.time()
-                slot_end = (current + timedelta(hours=1)).time()
-                
-                # Format times for display
-                start_str = slot_start.strftime("%H:%M")
-                end_str = slot_end.strftime("%H:%M")
-                display = f"{slot_start.strftime('%I:%M %p')} - {slot_end.strftime('%I:%M %p')}"
-                
-                # Check if this time slot is already in the list
-                existing = next((t for t in all_available_times if t["start_time"] == start_str and t["end_time"] == end_str), None)
-                
-                if not existing:
-                    all_available_times.append({
-                        "start_time": start_str,
-                        "end_time": end_str,
-                        "display": display
-                    })
-                
-                current += timedelta(minutes=30)  # 30-minute increments
-    
-    # Sort by start time
-    all_available_times.sort(key=lambda x: x["start_time"])
+    # Union of the slot start times of every instructor (school-wide lesson length and step),
+    # already sorted by start time
+    (duration, step), overrides = all_lesson_settings(db)
+    all_available_times = cached_day_slots(db, date, duration, step, overrides)
     
     return jsonify({"available_times": all_available_times})
 
@@ -304,6 +139,9 @@ def get_available_instructors():
     if not date or not start_time or not end_time:
         return jsonify({"error": "Missing parameters"}), 400
     
+    start_minutes = to_minutes(start_time)
+    end_minutes = to_minutes(end_time)
+    
     # Get all instructors
     instructors = db.execute(
         """
@@ -320,70 +158,18 @@ def get_available_instructors():
         """
     )
     
-    available_instructors = []
-    
-    # Check each instructor's availability
-    for instructor in instructors:
-        # Get all approved time requests for this instructor on this date
-        time_requests = db.execute(
-            """
-            SELECT 
-                start_time, 
-                end_time,
-                request_type,
-                processed_at
-            FROM time_requests 
-            WHERE instructor_id = ? 
-            AND status = 'approved'
-            AND request_date = ?
-            ORDER BY processed_at
-            """,
-            instructor["id"], date
-        )
-        
-        # Get open time ranges from the requests
-        open_ranges = open_time_ranges(time_requests)
-        
-        # Get existing lessons for this instructor on this date
-        existing_lessons = db.execute(
-            """
-            SELECT start_time, end_time
-            FROM lessons
-            WHERE instructor_id = ?
-            AND lesson_date = ?
-            AND status = 'booked'
-            """,
-            instructor["id"], date
-        )
-        
-        # Check if the requested time slot is available
-        start_time_obj = datetime.strptime(start_time, "%H:%M").time()
-        end_time_obj = datetime.strptime(end_time, "%H:%M").time()
-        
-        # First check if the time is within an open range
-        is_in_open_range = False
-        for open_range in open_ranges:
-            if start_time_obj >= open_range["start"] and end_time_obj <= open_range["end"]:
-                is_in_open_range = True
-                break
-        
-        if not is_in_open_range:
-            continue  # Skip this instructor
-        
-        # Then check if there's no overlapping lesson
-        has_overlapping_lesson = False
-        for lesson in existing_lessons:
-            lesson_start = datetime.strptime(lesson["start_time"], "%H:%M").time()
-            lesson_end = datetime.strptime(lesson["end_time"], "%H:%M").time()
-            
-            # Check for overlap
-            if ((start_time_obj < lesson_end and end_time_obj > lesson_start) or
-                (start_time_obj >= lesson_start and end_time_obj <= lesson_end)):
-                has_overlapping_lesson = True
-                break
-        
-        if not has_overlapping_lesson:
-            available_instructors.append(instructor)
+    # Get free time for every instructor on this date in one pass
+    free_grids = cached_free_grids(db, date)
+    free_ids = free_instructor_ids(free_grids, start_minutes, end_minutes)
+    
+    # Only instructors who teach lessons of this length
+    school_settings, instructor_settings = all_lesson_settings(db)
+    
+    available_instructors = [
+        instructor for instructor in instructors
+        if instructor["id"] in free_ids
+        and instructor_settings.get(instructor["id"], school_settings)[0] == end_minutes - start_minutes
+    ]
     
     return jsonify({"available_instructors": available_instructors})
 
@@ -418,30 +204,26 @@ def get_instructor_available_dates():
     else:
         last_day = datetime(year, month + 1, 1).date() - timedelta(days=1)
     
-    # Format dates for SQL query
-    first_day_str = first_day.strftime("%Y-%m-%d")
-    last_day_str = last_day.strftime("%Y-%m-%d")
-    
     # Get all dates with approved open time requests
     dates_with_open_times = db.execute(
         """
-        SELECT DISTINCT request_date
+        SELECT DISTINCT request_day
         FROM time_requests
         WHERE instructor_id = ?
         AND status = 'approved'
         AND request_type = 'open'
-        AND request_date BETWEEN ? AND ?
-        ORDER BY request_date
+        AND request_day BETWEEN ? AND ?
+        ORDER BY request_day
         """,
-        instructor_id, first_day_str, last_day_str
+        instructor_id, to_day(first_day), to_day(last_day)
     )
     
     # Convert to list of date strings
     available_dates = []
     
     for date_row in dates_with_open_times:
-        date_str = date_row["request_date"]
-        date_obj = datetime.strptime(date_str, "%Y-%m-%d").date()
+        date_obj = to_date(date_row["request_day"])
+        date_str = date_obj.isoformat()
         
         # Format for display
         display_date = date_obj.strftime("%A, %b %d, %Y")
@@ -481,29 +263,25 @@ def get_available_dates():
     else:
         last_day = datetime(year, month + 1, 1).date() - timedelta(days=1)
     
-    # Format dates for SQL query
-    first_day_str = first_day.strftime("%Y-%m-%d")
-    last_day_str = last_day.strftime("%Y-%m-%d")
-    
     # Get all dates with approved open time requests
     dates_with_open_times = db.execute(
         """
-        SELECT DISTINCT request_date
+        SELECT DISTINCT request_day
         FROM time_requests
         WHERE status = 'approved'
         AND request_type = 'open'
-        AND request_date BETWEEN ? AND ?
-        ORDER BY request_date
+        AND request_day BETWEEN ? AND ?
+        ORDER BY request_day
         """,
-        first_day_str, last_day_str
+        to_day(first_day), to_day(last_day)
     )
     
     # Convert to list of date strings
     available_dates = []
     
     for date_row in dates_with_open_times:
-        date_str = date_row["request_date"]
-        date_obj = datetime.strptime(date_str, "%Y-%m-%d").date()
+        date_obj = to_date(date_row["request_day"])
+        date_str = date_obj.isoformat()
         
         # Format for display
         display_date = date_obj.strftime("%A, %b %d, %Y")
@@ -516,118 +294,166 @@ def get_available_dates():
     
     return jsonify({"available_dates": available_dates})
 
-@customer_bp.route("/get_instructor_available_times", methods=["GET"])
+@customer_bp.route("/get_month_availability", methods=["GET"])
 @login_required
-def get_instructor_available_times():
-    """API endpoint to get available times for a specific instructor on a date"""
+def get_month_availability():
+    """API endpoint to get bookable start times for every day of a month (or a date range)"""
     
     # Ensure the current user is a customer
     if current_user.role != "customer":
         return jsonify({"error": "Unauthorized"}), 403
     
-    instructor_id = request.args.get("instructor_id")
-    date = request.args.get("date")
+    # Optional, limits the result to a single instructor
+    instructor_id = request.args.get("instructor_id") or None
     
-    if not instructor_id or not date:
-        return jsonify({"error": "Missing parameters"}), 400
+    start = request.args.get("start")
+    end = request.args.get("end")
     
-    # Get all approved time requests for this instructor on this date
-    time_requests = db.execute(
-        """
-        SELECT 
-            start_time, 
-            end_time,
-            request_type,
-            processed_at
-        FROM time_requests 
-        WHERE instructor_id = ? 
-        AND status = 'approved'
-        AND request_date = ?
-        ORDER BY processed_at
-        """,
-        instructor_id, date
+    if start and end:
+        # Arbitrary date range
+        try:
+            first_day = datetime.strptime(start, "%Y-%m-%d").date()
+            last_day = datetime.strptime(end, "%Y-%m-%d").date()
+        except ValueError:
+            return jsonify({"error": "Invalid date format"}), 400
+        
+        if last_day < first_day or (last_day - first_day).days > 92:
+            return jsonify({"error": "Invalid date range"}), 400
+    else:
+        # Whole month
+        year = request.args.get("year", datetime.now().year)
+        month = request.args.get("month", datetime.now().month)
+        
+        try:
+            year = int(year)
+            month = int(month)
+            first_day = datetime(year, month, 1).date()
+        except ValueError:
+            return jsonify({"error": "Invalid year or month"}), 400
+        
+        # Get the last day of the month
+        if month == 12:
+            last_day = datetime(year + 1, 1, 1).date() - timedelta(days=1)
+        else:
+            last_day = datetime(year, month + 1, 1).date() - timedelta(days=1)
+    
+    # Lesson length and step of the instructor, or the school-wide ones
+    if instructor_id:
+        duration, step = get_lesson_settings(db, instructor_id)
+        overrides = {}
+    else:
+        (duration, step), overrides = all_lesson_settings(db)
+    
+    # For each day, a grid of the cells where a slot can start across all instructors,
+    # sent as a hex string (bit n = start at n * cell_minutes); days that aren't cached
+    # are loaded in one pass
+    range_starts = cached_range_slot_starts(
+        db, first_day.strftime("%Y-%m-%d"), last_day.strftime("%Y-%m-%d"), duration, step, overrides, instructor_id
     )
+    days = {}
     
-    # Get open time ranges from the requests
-    open_ranges = open_time_ranges(time_requests)
+    for day, starts in range_starts.items():
+        if starts:
+            days[day] = format(starts, "x")
     
-    # Get existing lessons for this instructor on this date
-    existing_lessons = db.execute(
-        """
-        SELECT start_time, end_time
-        FROM lessons
-        WHERE instructor_id = ?
-        AND lesson_date = ?
-        AND status = 'booked'
-        ORDER BY start_time
-        """,
-        instructor_id, date
-    )
+    return jsonify({
+        "cell_minutes": CELL_MINUTES,
+        "duration": duration,
+        "days": days
+    })
+
+@customer_bp.route("/find_next_available", methods=["GET"])
+@login_required
+def find_next_available():
+    """API endpoint to find the earliest bookable slots from a date on (for one or any instructor)"""
     
-    # Remove times that are already booked
-    for lesson in existing_lessons:
-        lesson_start = datetime.strptime(lesson["start_time"], "%H:%M").time()
-        lesson_end = datetime.strptime(lesson["end_time"], "%H:%M").time()
-        
-        updated_ranges = []
-        
-        for open_range in open_ranges:
-            # Case 1: Lesson completely covers open range - skip this open range
-            if lesson_start <= open_range["start"] and lesson_end >= open_range["end"]:
-                continue
-            
-            # Case 2: Lesson is completely within open range - split into two
-            elif lesson_start > open_range["start"] and lesson_end < open_range["end"]:
-                updated_ranges.append({"start": open_range["start"], "end": lesson_start})
-                updated_ranges.append({"start": lesson_end, "end": open_range["end"]})
-            
-            # Case 3: Lesson overlaps with start of open range
-            elif lesson_start <= open_range["start"] and lesson_end > open_range["start"] and lesson_end < open_range["end"]:
-                updated_ranges.append({"start": lesson_end, "end": open_range["end"]})
-            
-            # Case 4: Lesson overlaps with end of open range
-            elif lesson_start > open_range["start"] and lesson_start < open_range["end"] and lesson_end >= open_range["end"]:
-                updated_ranges.append({"start": open_range["start"], "end": lesson_start})
-            
-            # Case 5: No overlap - keep the open range as is
-            else:
-                updated_ranges.append(open_range)
-        
-        # Replace the open ranges with the updated ones
-        open_ranges = updated_ranges
+    # Ensure the current user is a customer
+    if current_user.role != "customer":
+        return jsonify({"error": "Unauthorized"}), 403
     
-    # Create 1-hour slots within each open range
-    available_times = []
+    # Optional, limits the search to a single instructor
+    instructor_id = request.args.get("instructor_id") or None
     
-    for open_range in open_ranges:
-        start = open_range["start"]
-        end = open_range["end"]
-        
-        # Convert to datetime for easier arithmetic
-        start_dt = datetime.combine(datetime.today(), start)
-        end_dt = datetime.combine(datetime.today(), end)
-        
-        # Create 1-hour slots
-        current = start_dt
-        while current + timedelta(hours=1) <= end_dt:
-            slot_start = current.time()
-            slot_end = (current + timedelta(hours=1)).time()
-            
-            # Format times for display
-            start_str = slot_start.strftime("%H:%M")
-            end_str = slot_end.strftime("%H:%M")
-            display = f"{slot_start.strftime('%I:%M %p')} - {slot_end.strftime('%I:%M %p')}"
-            
-            available_times.append({
-                "start_time": start_str,
-                "end_time": end_str,
-                "display": display
-            })
-            
-            current += timedelta(minutes=30)  # 30-minute increments
+    now = datetime.now()
+    today = now.strftime("%Y-%m-%d")
+    start_date = request.args.get("start_date") or today
+    
+    # Lesson length and step default to the instructor's, or the school-wide ones
+    default_duration, default_step = get_lesson_settings(db, instructor_id)
+    
+    try:
+        datetime.strptime(start_date, "%Y-%m-%d")
+        duration = int(request.args.get("duration", default_duration))
+        step = int(request.args.get("step", default_step))
+        limit = int(request.args.get("limit", 5))
+    except ValueError:
+        return jsonify({"error": "Invalid parameters"}), 400
+    
+    # Durations and steps must be whole cells of the day grid, like the owner's settings
+    if not valid_lesson_settings(duration, step):
+        return jsonify({"error": f"Duration and step must be multiples of {CELL_MINUTES} minutes"}), 400
     
-    # Sort by start time
-    available_times.sort(key=lambda x: x["start_time"])
+    if not 0 < limit <= 50:
+        return jsonify({"error": "Invalid parameters"}), 400
+    
+    # Never offer times that are already past
+    not_before = 0
+    if start_date <= today:
+        start_date = today
+        not_before = now.hour * 60 + now.minute
+    
+    # Without an instructor, leave out instructors who teach lessons of another length
+    skip_instructors = set()
+    if not instructor_id:
+        school_settings, instructor_settings = all_lesson_settings(db)
+        skip_instructors = {
+            row["id"] for row in db.execute("SELECT id FROM users WHERE role = 'instructor'")
+            if instructor_settings.get(row["id"], school_settings)[0] != duration
+        }
+    
+    slots = find_next_slots(db, start_date, duration, step, limit, instructor_id, not_before,
+                            skip_instructors=skip_instructors)
+    
+    # Names of the instructors in the result
+    instructor_names = {}
+    instructor_ids = sorted({slot[3] for slot in slots})
+    if instructor_ids:
+        placeholders = ", ".join(["?"] * len(instructor_ids))
+        for row in db.execute(f"SELECT id, name, surname FROM user_info WHERE id IN ({placeholders})", *instructor_ids):
+            instructor_names[row["id"]] = f"{row['name']} {row['surname']}"
+    
+    next_available = []
+    for day, start, end, slot_instructor_id in slots:
+        next_available.append({
+            "date": day,
+            "date_display": datetime.strptime(day, "%Y-%m-%d").strftime("%A, %b %d, %Y"),
+            "start_time": to_hhmm(start),
+            "end_time": to_hhmm(end),
+            "display": f"{to_display(start)} - {to_display(end)}",
+            "instructor_id": slot_instructor_id,
+            "instructor_name": instructor_names.get(slot_instructor_id, "")
+        })
+    
+    return jsonify({"next_available": next_available})
+
+@customer_bp.route("/get_instructor_available_times", methods=["GET"])
+@login_required
+def get_instructor_available_times():
+    """API endpoint to get available times for a specific instructor on a date"""
+    
+    # Ensure the current user is a customer
+    if current_user.role != "customer":
+        return jsonify({"error": "Unauthorized"}), 403
+    
+    instructor_id = request.args.get("instructor_id")
+    date = request.args.get("date")
+    
+    if not instructor_id or not date:
+        return jsonify({"error": "Missing parameters"}), 400
+    
+    # Slots of the instructor's lesson length and step within each free range, already sorted by start time
+    duration, step = get_lesson_settings(db, instructor_id)
+    available_times = cached_instructor_slots(db, date, instructor_id, duration, step)
     
     return jsonify({"available_times": available_times})
 
@@ -650,7 +476,7 @@ def cancel_lesson():
     # Check if the lesson exists and belongs to the current user
     lesson = db.execute(
         """
-        SELECT id, lesson_date, start_time 
+        SELECT id, instructor_id, lesson_date, lesson_day, start_minute
         FROM lessons 
         WHERE id = ? AND customer_id = ? AND status = 'booked'
         """,
@@ -662,9 +488,10 @@ def cancel_lesson():
         return redirect("/customer/my_lessons")
     
     # Check if the lesson is in the future
-    lesson_date = datetime.strptime(lesson[0]["lesson_date"], "%Y-%m-%d").date()
-    lesson_time = datetime.strptime(lesson[0]["start_time"], "%H:%M").time()
-    lesson_datetime = datetime.combine(lesson_date, lesson_time)
+    lesson_datetime = (
+        datetime.combine(to_date(lesson[0]["lesson_day"]), datetime.min.time())
+        + timedelta(minutes=lesson[0]["start_minute"])
+    )
     
     # Calculate cancellation policy (e.g., 24 hours in advance)
     cancellation_deadline = datetime.now() + timedelta(hours=24)
@@ -673,121 +500,23 @@ def cancel_lesson():
         flash("Lessons must be cancelled at least 24 hours in advance", "danger")
         return redirect("/customer/my_lessons")
     
-    # Update the lesson status to cancelled
-    db.execute(
-        "UPDATE lessons SET status = 'cancelled' WHERE id = ?",
-        lesson_id
-    )
-    
-    flash("Lesson cancelled successfully", "success")
-    return redirect("/customer/my_lessons")
-
-
-    """API endpoint to get available times for an instructor on a specific date"""
-    
-    # Ensure the current user is a customer
-    if current_user.role != "customer":
-        return jsonify({"error": "Unauthorized"}), 403
-    
-    instructor_id = request.args.get("instructor_id")
-    date = request.args.get("date")
-    
-    if not instructor_id or not date:
-        return jsonify({"error": "Missing parameters"}), 400
-    
-    # Get all approved time requests for this instructor on this date
-    time_requests = db.execute(
-        """
-        SELECT 
-            request_date, 
-            start_time, 
-            end_time,
-            request_type,
-            processed_at
-        FROM time_requests 
-        WHERE instructor_id = ? 
-        AND status = 'approved'
-        AND request_date = ?
-        ORDER BY processed_at
-        """,
-        instructor_id, date
-    )
-    
-    # Get open time ranges from the requests
-    open_ranges = open_time_ranges(time_requests)
-    
-    # Get existing lessons for this instructor on this date
-    existing_lessons = db.execute(
-        """
-        SELECT start_time, end_time
-        FROM lessons
-        WHERE instructor_id = ?
-        AND lesson_date = ?
-        AND status = 'booked'
-        ORDER BY start_time
-        """,
-        instructor_id, date
-    )
-    
-    # Remove times that are already booked
-    for lesson in existing_lessons:
-        lesson_start = datetime.strptime(lesson["start_time"], "%H:%M").time()
-        lesson_end = datetime.strptime(lesson["end_time"], "%H:%M").time()
-        
-        updated_ranges = []
-        
-        for open_range in open_ranges:
-            # Case 1: Lesson completely covers open range - skip this open range
-            if lesson_start <= open_range["start"] and lesson_end >= open_range["end"]:
-                continue
-            
-            # Case 2: Lesson is completely within open range - split into two
-            elif lesson_start > open_range["start"] and lesson_end < open_range["end"]:
-                updated_ranges.append({"start": open_range["start"], "end": lesson_start})
-                updated_ranges.append({"start": lesson_end, "end": open_range["end"]})
-            
-            # Case 3: Lesson overlaps with start of open range
-            elif lesson_start <= open_range["start"] and lesson_end > open_range["start"] and lesson_end < open_range["end"]:
-                updated_ranges.append({"start": lesson_end, "end": open_range["end"]})
-            
-            # Case 4: Lesson overlaps with end of open range
-            elif lesson_start > open_range["start"] and lesson_start < open_range["end"] and lesson_end >= open_range["end"]:
-                updated_ranges.append({"start": open_range["start"], "end": lesson_start})
-            
-            # Case 5: No overlap - keep the open range as is
-            else:
-                updated_ranges.append(open_range)
-        
-        # Replace the open ranges with the updated ones
-        open_ranges = updated_ranges
+    # Update the lesson status to cancelled and give its time back to the instructor together
+    with db.transaction("IMMEDIATE"):
+        cancelled = db.execute(
+            "UPDATE lessons SET status = 'cancelled' WHERE id = ? AND status = 'booked'",
+            lesson_id
+        )
+        if cancelled:
+            refresh_availability_days(db, [(lesson[0]["instructor_id"], lesson[0]["lesson_date"])])
     
-    # Format the available times for the response
-    available_times = []
+    if not cancelled:
+        flash("Lesson not found or already cancelled", "danger")
+        return redirect("/customer/my_lessons")
     
-    for open_range in open_ranges:
-        # Create 1-hour slots within each open range
-        start = open_range["start"]
-        end = open_range["end"]
-        
-        # Convert to datetime for easier arithmetic
-        start_dt = datetime.combine(datetime.today(), start)
-        end_dt = datetime.combine(datetime.today(), end)
-        
-        # Create 1-hour slots
-        current = start_dt
-        while current + timedelta(hours=1) <= end_dt:
-            slot_start = current.time()
-            slot_end = (current + timedelta(hours=1)).time()
-            
-            available_times.append({
-                "start_time": slot_start.strftime("%H:%M"),
-                "end_time": slot_end.strftime("%H:%M"),
-                "display": f"{slot_start.strftime('%I:%M %p')} - {slot_end.strftime('%I:%M %p')}"
-            })
-            
-            current += timedelta(minutes=30)  # 30-minute increments
+    invalidate_availability(lesson[0]["instructor_id"], lesson[0]["lesson_date"])
     
-    return jsonify({"available_times": available_times})
+    flash("Lesson cancelled successfully", "success")
+    return redirect("/customer/my_lessons")
 
 @customer_bp.route("/my_lessons", methods=["GET"])
 @login_required
@@ -799,6 +528,11 @@ def customer_my_lessons():
         flash("You don't have permission to access this page", "danger")
         return redirect("/")
     
+    # Lessons of today that haven't ended yet are upcoming
+    now = datetime.now()
+    today_day = to_day(now.date())
+    now_minutes = now.hour * 60 + now.minute
+    
     # Get upcoming lessons
     upcoming_lessons = db.execute(
         """
@@ -817,12 +551,12 @@ def customer_my_lessons():
         JOIN users AS instructor ON lessons.instructor_id = instructor.id
         JOIN user_info AS instructor_info ON instructor.id = instructor_info.id
         WHERE lessons.customer_id = ?
-        AND (lessons.lesson_date > CURRENT_DATE OR 
-             (lessons.lesson_date = CURRENT_DATE AND lessons.end_time >= strftime('%H:%M', 'now', 'localtime')))
+        AND (lessons.lesson_day > ? OR 
+             (lessons.lesson_day = ? AND lessons.end_minute >= ?))
         AND lessons.status = 'booked'
-        ORDER BY lessons.lesson_date, lessons.start_time
+        ORDER BY lessons.lesson_day, lessons.start_minute
         """,
-        current_user.id
+        current_user.id, today_day, today_day, now_minutes
     )
     
     # Get past lessons
@@ -843,13 +577,13 @@ def customer_my_lessons():
         JOIN users AS instructor ON lessons.instructor_id = instructor.id
         JOIN user_info AS instructor_info ON instructor.id = instructor_info.id
         WHERE lessons.customer_id = ?
-        AND (lessons.lesson_date < CURRENT_DATE OR 
-             (lessons.lesson_date = CURRENT_DATE AND lessons.end_time < strftime('%H:%M', 'now', 'localtime'))
+        AND (lessons.lesson_day < ? OR 
+             (lessons.lesson_day = ? AND lessons.end_minute < ?)
              OR lessons.status IN ('completed', 'cancelled', 'no-show'))
-        ORDER BY lessons.lesson_date DESC, lessons.start_time DESC
+        ORDER BY lessons.lesson_day DESC, lessons.start_minute DESC
         LIMIT 20
         """,
-        current_user.id
+        current_user.id, today_day, today_day, now_minutes
     )
     
     return render_template(
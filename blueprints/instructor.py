@@ -1,12 +1,14 @@
 from flask import Blueprint, render_template, request, redirect, flash, jsonify
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta, date
-from cs50 import SQL
 
-from helpers import open_time_ranges
+from database import db
+from intervals import to_minutes, DISPLAY_LABELS
+from days import to_day, to_date
+from booking import lesson_overlaps
+from working_hours import get_working_hours
 
 instructor_bp = Blueprint("instructor_bp", __name__)
-db = SQL("sqlite:///database.db")
 
 ########################### Instructor routes ##################################
 
@@ -54,17 +56,16 @@ def  request_time():
         flash("Invalid request type", "danger")
         return redirect("/instructor/calendar")
     
-    # Check if there are any existing lessons during this time
-    existing_lessons = db.execute(
-        """
-        SELECT * FROM lessons
-        WHERE instructor_id = ? AND lesson_date = ? AND status != 'cancelled'
-        AND ((start_time <= ? AND end_time > ?) OR (start_time < ? AND end_time >= ?) OR (start_time >= ? AND end_time <= ?))
-        """,
-        current_user.id, request_date, start_time, start_time, end_time, end_time, start_time, end_time
-    )
+    try:
+        request_day = to_day(request_date)
+        start_minutes = to_minutes(start_time)
+        end_minutes = to_minutes(end_time)
+    except ValueError:
+        flash("Invalid date or time format", "danger")
+        return redirect("/instructor/calendar")
     
-    if existing_lessons:
+    # Check if there are any existing lessons during this time
+    if lesson_overlaps(db, current_user.id, request_date, start_minutes, end_minutes):
         flash("You have lessons scheduled during this time. Please choose a different time.", "danger")
         return redirect("/instructor/calendar")
     
@@ -72,10 +73,10 @@ def  request_time():
     existing_request = db.execute(
         """
         SELECT * FROM time_requests
-        WHERE instructor_id = ? AND request_date = ? AND status = 'pending'
-        AND ((start_time <= ? AND end_time > ?) OR (start_time < ? AND end_time >= ?) OR (start_time >= ? AND end_time <= ?))
+        WHERE instructor_id = ? AND request_day = ? AND status = 'pending'
+        AND ((start_minute <= ? AND end_minute > ?) OR (start_minute < ? AND end_minute >= ?) OR (start_minute >= ? AND end_minute <= ?))
         """,
-        current_user.id, request_date, start_time, start_time, end_time, end_time, start_time, end_time
+        current_user.id, request_day, start_minutes, start_minutes, end_minutes, end_minutes, start_minutes, end_minutes
     )
         
     if existing_request:
@@ -85,10 +86,10 @@ def  request_time():
     # Add the time request
     db.execute(
         """
-        INSERT INTO time_requests (instructor_id, request_date, start_time, end_time, request_type, status, created_at)
+        INSERT INTO time_requests (instructor_id, request_day, start_minute, end_minute, request_type, status, created_at)
         VALUES (?, ?, ?, ?, ?, 'pending', CURRENT_TIMESTAMP)
         """,
-        current_user.id, request_date, start_time, end_time, request_type
+        current_user.id, request_day, start_minutes, end_minutes, request_type
     )
             
     flash("Time request submitted successfully. An admin will review your request.", "success")
@@ -160,20 +161,20 @@ def instructor_calendar():
     next_lesson_day = db.execute(
         """
         SELECT 
-            lesson_date
+            lesson_day
         FROM lessons
         WHERE instructor_id = ? 
-        AND lesson_date >= CURRENT_DATE
+        AND lesson_day >= ?
         AND status != 'cancelled'
-        ORDER BY lesson_date
+        ORDER BY lesson_day
         LIMIT 1
         """,
-        current_user.id
+        current_user.id, to_day(today.date())
     )
     
     # If no upcoming lessons, default to today
     if next_lesson_day:
-        next_day = datetime.strptime(next_lesson_day[0]["lesson_date"], "%Y-%m-%d").date()
+        next_day = to_date(next_lesson_day[0]["lesson_day"])
     else:
         next_day = today.date()
     
@@ -187,12 +188,12 @@ def instructor_calendar():
             end_time
         FROM time_requests
         WHERE instructor_id = ? 
-        AND request_date BETWEEN ? AND ?
+        AND request_day BETWEEN ? AND ?
         AND request_type = 'open'
         AND status = 'approved'
-        ORDER BY request_date, start_time
+        ORDER BY request_day, start_minute
         """,
-        current_user.id, first_day.strftime("%Y-%m-%d"), last_day.strftime("%Y-%m-%d")
+        current_user.id, to_day(first_day), to_day(last_day)
     )
     
     # Get instructor unavailabilities for the month (approved "close" time requests)
@@ -205,12 +206,12 @@ def instructor_calendar():
             end_time
         FROM time_requests
         WHERE instructor_id = ? 
-        AND request_date BETWEEN ? AND ?
+        AND request_day BETWEEN ? AND ?
         AND request_type = 'close'
         AND status = 'approved'
-        ORDER BY request_date, start_time
+        ORDER BY request_day, start_minute
         """,
-        current_user.id, first_day.strftime("%Y-%m-%d"), last_day.strftime("%Y-%m-%d")
+        current_user.id, to_day(first_day), to_day(last_day)
     )
     
     # Get detailed lessons for the next day with lessons
@@ -234,11 +235,11 @@ def instructor_calendar():
         JOIN users u ON l.customer_id = u.id
         LEFT JOIN user_info ui ON u.id = ui.id
         WHERE l.instructor_id = ? 
-        AND l.lesson_date = ?
+        AND l.lesson_day = ?
         AND l.status != 'cancelled'
-        ORDER BY l.start_time
+        ORDER BY l.start_minute
         """,
-        current_user.id, next_day.strftime("%Y-%m-%d")
+        current_user.id, to_day(next_day)
     )
     
     # Get all lessons for the month with detailed info (for monthly calendar view)
@@ -262,11 +263,11 @@ def instructor_calendar():
         JOIN users u ON l.customer_id = u.id
         LEFT JOIN user_info ui ON u.id = ui.id
         WHERE l.instructor_id = ? 
-        AND l.lesson_date BETWEEN ? AND ?
+        AND l.lesson_day BETWEEN ? AND ?
         AND l.status != 'cancelled'
-        ORDER BY l.lesson_date, l.start_time
+        ORDER BY l.lesson_day, l.start_minute
         """,
-        current_user.id, first_day.strftime("%Y-%m-%d"), last_day.strftime("%Y-%m-%d")
+        current_user.id, to_day(first_day), to_day(last_day)
     )
     
     # Get pending time requests
@@ -282,7 +283,7 @@ def instructor_calendar():
             created_at
         FROM time_requests
         WHERE instructor_id = ?
-        ORDER BY request_date, start_time
+        ORDER BY request_day, start_minute
         """,
         current_user.id
     )
@@ -298,29 +299,8 @@ def instructor_calendar():
         time_slots.append(current_time.strftime("%H:%M"))
         current_time += interval
     
-    # Get working hours for each day of the week
-    working_hours = db.execute("SELECT * FROM working_hours ORDER BY day_of_week")
-    
-    # Create a dictionary for easier access in template
-    days_of_week = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
-    hours_by_day = {}
-    
-    for day in range(7):
-        hours_by_day[day] = {
-            "name": days_of_week[day],
-            "open_time": "09:00",
-            "close_time": "17:00",
-            "is_open": True
-        }
-    
-    for hours in working_hours:
-        day = hours["day_of_week"]
-        hours_by_day[day] = {
-            "name": days_of_week[day],
-            "open_time": hours["open_time"],
-            "close_time": hours["close_time"],
-            "is_open": hours["is_open"]
-        }
+    # Working hours of every day of the week, with defaults for days that aren't set
+    hours_by_day = get_working_hours(db).hours_by_day()
     
     # Get current month for calendar
     current_month = today.strftime("%B %Y")
@@ -389,12 +369,12 @@ def get_instructor_calendar():
             end_time
         FROM time_requests
         WHERE instructor_id = ? 
-        AND request_date BETWEEN ? AND ?
+        AND request_day BETWEEN ? AND ?
         AND request_type = 'open'
         AND status = 'approved'
-        ORDER BY request_date, start_time
+        ORDER BY request_day, start_minute
         """,
-        current_user.id, first_day.strftime("%Y-%m-%d"), last_day.strftime("%Y-%m-%d")
+        current_user.id, to_day(first_day), to_day(last_day)
     )
     
     # Get instructor unavailabilities for the month (approved "close" time requests)
@@ -407,12 +387,12 @@ def get_instructor_calendar():
             end_time
         FROM time_requests
         WHERE instructor_id = ? 
-        AND request_date BETWEEN ? AND ?
+        AND request_day BETWEEN ? AND ?
         AND request_type = 'close'
         AND status = 'approved'
-        ORDER BY request_date, start_time
+        ORDER BY request_day, start_minute
         """,
-        current_user.id, first_day.strftime("%Y-%m-%d"), last_day.strftime("%Y-%m-%d")
+        current_user.id, to_day(first_day), to_day(last_day)
     )
     
     # Get lessons for the instructor for the month
@@ -435,26 +415,15 @@ def get_instructor_calendar():
         JOIN users u ON l.customer_id = u.id
         LEFT JOIN user_info ui ON u.id = ui.id
         WHERE l.instructor_id = ? 
-        AND l.lesson_date BETWEEN ? AND ?
+        AND l.lesson_day BETWEEN ? AND ?
         AND l.status != 'cancelled'
-        ORDER BY l.lesson_date, l.start_time
+        ORDER BY l.lesson_day, l.start_minute
         """,
-        current_user.id, first_day.strftime("%Y-%m-%d"), last_day.strftime("%Y-%m-%d")
+        current_user.id, to_day(first_day), to_day(last_day)
     )
     
-    # Get working hours for each day of the week
-    working_hours = db.execute("SELECT * FROM working_hours ORDER BY day_of_week")
-    
-    # Create a dictionary for easier access in the frontend
-    hours_by_day = {}
-    
-    for hours in working_hours:
-        day = hours["day_of_week"]
-        hours_by_day[day] = {
-            "open_time": hours["open_time"],
-            "close_time": hours["close_time"],
-            "is_open": hours["is_open"]
-        }
+    # Working hours of the days that are set, for the frontend
+    hours_by_day = get_working_hours(db).configured_hours()
     
     # Return the data as JSON
     return jsonify({
@@ -476,8 +445,10 @@ def instructor_history():
         flash("You don't have permission to access this page", "danger")
         return redirect("/")
     
-    # Get current date for comparison
-    current_date = datetime.now().strftime("%Y-%m-%d")
+    # Get current date and time for comparison
+    now = datetime.now()
+    current_day = to_day(now.date())
+    current_minutes = now.hour * 60 + now.minute
     
     # Get all past lessons for this instructor
     past_lessons = db.execute(
@@ -485,8 +456,11 @@ def instructor_history():
         SELECT 
             l.id, 
             l.lesson_date, 
+            l.lesson_day,
             l.start_time, 
             l.end_time, 
+            l.start_minute,
+            l.end_minute,
             l.status,
             l.notes,
             l.created_at,
@@ -500,18 +474,18 @@ def instructor_history():
         JOIN users u ON l.customer_id = u.id
         JOIN user_info ui ON u.id = ui.id
         WHERE l.instructor_id = ?
-        AND (l.lesson_date < ? OR (l.lesson_date = ? AND l.end_time < strftime('%H:%M', 'now')))
-        ORDER BY l.lesson_date DESC, l.start_time DESC
+        AND (l.lesson_day < ? OR (l.lesson_day = ? AND l.end_minute < ?))
+        ORDER BY l.lesson_day DESC, l.start_minute DESC
         """,
-        current_user.id, current_date, current_date
+        current_user.id, current_day, current_day, current_minutes
     )
     
     # Group lessons by month for better organization
     grouped_lessons = {}
     
     for lesson in past_lessons:
-        # Convert date string to datetime object
-        lesson_date = datetime.strptime(lesson["lesson_date"], "%Y-%m-%d")
+        # Convert the day number to a date
+        lesson_date = to_date(lesson["lesson_day"])
         
         # Format month and year as a key
         month_year = lesson_date.strftime("%B %Y")
@@ -524,9 +498,7 @@ def instructor_history():
         lesson["formatted_date"] = lesson_date.strftime("%A, %B %d, %Y")
         
         # Format time for display
-        start_time = datetime.strptime(lesson["start_time"], "%H:%M").strftime("%I:%M %p")
-        end_time = datetime.strptime(lesson["end_time"], "%H:%M").strftime("%I:%M %p")
-        lesson["formatted_time"] = f"{start_time} - {end_time}"
+        lesson["formatted_time"] = f"{DISPLAY_LABELS[lesson['start_minute']]} - {DISPLAY_LABELS[lesson['end_minute']]}"
         
         # Add to group
         grouped_lessons[month_year].append(lesson)
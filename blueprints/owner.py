@@ -1,13 +1,22 @@
-from flask import Blueprint, render_template, request, redirect, flash, jsonify
+from flask import Blueprint, render_template, request, redirect, flash, jsonify, Response, stream_with_context
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta, date
-from cs50 import SQL
+import io
 from werkzeug.security import generate_password_hash
 
-from helpers import open_time_ranges, handle_profile_picture
+from database import db
+from helpers import handle_profile_picture
+from daygrid import CELL_MINUTES
+from days import to_day
+from intervals import to_minutes
+from availability import refresh_availability_days, invalidate_availability, availability_cache
+from lesson_settings import all_lesson_settings, save_lesson_settings, delete_lesson_settings, valid_lesson_settings
+from user_cache import invalidate_user
+from user_search import search_users, in_rank_order
+from working_hours import get_working_hours, invalidate_working_hours
+from data_transfer import TABLES, MIMETYPES, TransferError, export_table, import_table, transfer_format
 
 owner_bp = Blueprint("owner_bp", __name__)
-db = SQL("sqlite:///database.db")
 
 ########################### Owner routes ##################################
 
@@ -61,35 +70,72 @@ def owner_working_hours():
             )
             flash("Working hours added successfully", "success")
         
+        invalidate_working_hours()
         return redirect("/owner/working_hours")
     
-    # Get current working hours
-    working_hours = db.execute(
-        "SELECT * FROM working_hours ORDER BY day_of_week"
+    # Working hours of every day of the week, with defaults for days that aren't set
+    hours_by_day = get_working_hours(db).hours_by_day()
+    
+    return render_template("owner/working_hours.html", hours_by_day=hours_by_day)
+
+@owner_bp.route("/lesson_settings", methods=["GET", "POST"])
+@login_required
+def owner_lesson_settings():
+    """Manage lesson length and slot step, school-wide or per instructor"""
+    
+    # Ensure the current user is an owner
+    if current_user.role != "owner":
+        flash("You don't have permission to access this page", "danger")
+        return redirect("/")
+    
+    if request.method == "POST":
+        # Empty for the school-wide setting
+        instructor_id = request.form.get("instructor_id") or None
+        
+        # Instructor goes back to the school-wide setting
+        if instructor_id and "reset" in request.form:
+            delete_lesson_settings(db, instructor_id)
+            flash("Lesson settings reset to the school default", "success")
+            return redirect("/owner/lesson_settings")
+        
+        try:
+            duration = int(request.form.get("duration"))
+            step = int(request.form.get("step"))
+        except (TypeError, ValueError):
+            flash("Please fill in all required fields", "danger")
+            return redirect("/owner/lesson_settings")
+        
+        if not valid_lesson_settings(duration, step):
+            flash(f"Duration and step must be multiples of {CELL_MINUTES} minutes", "danger")
+            return redirect("/owner/lesson_settings")
+        
+        if instructor_id and not db.execute("SELECT id FROM users WHERE id = ? AND role = 'instructor'", instructor_id):
+            flash("Invalid instructor selected", "danger")
+            return redirect("/owner/lesson_settings")
+        
+        save_lesson_settings(db, duration, step, instructor_id)
+        flash("Lesson settings updated successfully", "success")
+        return redirect("/owner/lesson_settings")
+    
+    school_settings, instructor_settings = all_lesson_settings(db)
+    
+    instructors = db.execute(
+        """
+        SELECT users.id, user_info.name, user_info.surname
+        FROM users JOIN user_info ON users.id = user_info.id
+        WHERE users.role = 'instructor'
+        ORDER BY user_info.name, user_info.surname
+        """
     )
     
-    # Create a dictionary for easier access in template
-    days_of_week = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
-    hours_by_day = {}
-    
-    for day in range(7):
-        hours_by_day[day] = {
-            "name": days_of_week[day],
-            "open_time": "09:00",
-            "close_time": "17:00",
-            "is_open": True
-        }
-    
-    for hours in working_hours:
-        day = hours["day_of_week"]
-        hours_by_day[day] = {
-            "name": days_of_week[day],
-            "open_time": hours["open_time"],
-            "close_time": hours["close_time"],
-            "is_open": hours["is_open"]
-        }
+    for instructor in instructors:
+        instructor["settings"] = instructor_settings.get(instructor["id"])
     
-    return render_template("owner/working_hours.html", hours_by_day=hours_by_day)
+    return render_template(
+        "owner/lesson_settings.html",
+        school_settings=school_settings,
+        instructors=instructors
+    )
 
 @owner_bp.route("/get_admin_calendar")
 @login_required
@@ -133,25 +179,14 @@ def get_admin_calendar():
             start_time,
             end_time
         FROM admin_schedules
-        WHERE admin_id = ? AND work_date BETWEEN ? AND ?
-        ORDER BY work_date, start_time
+        WHERE admin_id = ? AND work_day BETWEEN ? AND ?
+        ORDER BY work_day, start_minute
         """,
-        admin_id, first_day.strftime("%Y-%m-%d"), last_day.strftime("%Y-%m-%d")
+        admin_id, to_day(first_day), to_day(last_day)
     )
     
-    # Get working hours for each day of the week
-    working_hours = db.execute("SELECT * FROM working_hours ORDER BY day_of_week")
-    
-    # Create a dictionary for easier access in the frontend
-    hours_by_day = {}
-    
-    for hours in working_hours:
-        day = hours["day_of_week"]
-        hours_by_day[day] = {
-            "open_time": hours["open_time"],
-            "close_time": hours["close_time"],
-            "is_open": hours["is_open"]
-        }
+    # Working hours of the days that are set, for the frontend
+    hours_by_day = get_working_hours(db).configured_hours()
     
     # Return the data as JSON
     return jsonify({
@@ -202,10 +237,10 @@ def get_all_admin_calendars():
             a.end_time
         FROM admin_schedules a
         JOIN users u ON a.admin_id = u.id
-        WHERE a.work_date BETWEEN ? AND ?
-        ORDER BY a.work_date, a.start_time
+        WHERE a.work_day BETWEEN ? AND ?
+        ORDER BY a.work_day, a.start_minute
         """,
-        first_day.strftime("%Y-%m-%d"), last_day.strftime("%Y-%m-%d")
+        to_day(first_day), to_day(last_day)
     )
     
     # Get only admins who have schedules in this month
@@ -228,19 +263,8 @@ def get_all_admin_calendars():
             """
         )
     
-    # Get working hours for each day of the week
-    working_hours = db.execute("SELECT * FROM working_hours ORDER BY day_of_week")
-    
-    # Create a dictionary for easier access in the frontend
-    hours_by_day = {}
-    
-    for hours in working_hours:
-        day = hours["day_of_week"]
-        hours_by_day[day] = {
-            "open_time": hours["open_time"],
-            "close_time": hours["close_time"],
-            "is_open": hours["is_open"]
-        }
+    # Working hours of the days that are set, for the frontend
+    hours_by_day = get_working_hours(db).configured_hours()
     
     # Return the data as JSON
     return jsonify({
@@ -301,29 +325,37 @@ def admin_schedule():
             flash("Invalid admin selected", "danger")
             return redirect("/owner/admin_schedule")
         
+        try:
+            work_day = to_day(work_date)
+            start_minutes = to_minutes(start_time)
+            end_minutes = to_minutes(end_time)
+        except ValueError:
+            flash("Invalid date or time format", "danger")
+            return redirect("/owner/admin_schedule")
+        
         # Check if end time is after start time
-        if start_time >= end_time:
+        if start_minutes >= end_minutes:
             flash("End time must be after start time", "danger")
             return redirect("/owner/admin_schedule")
         
         # Check if schedule already exists for this admin on this date
         existing_schedule = db.execute(
-            "SELECT * FROM admin_schedules WHERE admin_id = ? AND work_date = ?",
-            admin_id, work_date
+            "SELECT id FROM admin_schedules WHERE admin_id = ? AND work_day = ?",
+            admin_id, work_day
         )
         
         if existing_schedule:
             # Update existing schedule
             db.execute(
-                "UPDATE admin_schedules SET start_time = ?, end_time = ? WHERE id = ?",
-                start_time, end_time, existing_schedule[0]["id"]
+                "UPDATE admin_schedules SET start_minute = ?, end_minute = ? WHERE id = ?",
+                start_minutes, end_minutes, existing_schedule[0]["id"]
             )
             flash("Admin schedule updated successfully", "success")
         else:
             # Add new schedule
             db.execute(
-                "INSERT INTO admin_schedules (admin_id, work_date, start_time, end_time) VALUES (?, ?, ?, ?)",
-                admin_id, work_date, start_time, end_time
+                "INSERT INTO admin_schedules (admin_id, work_day, start_minute, end_minute) VALUES (?, ?, ?, ?)",
+                admin_id, work_day, start_minutes, end_minutes
             )
             flash("Admin schedule added successfully", "success")
         
@@ -348,10 +380,11 @@ def admin_schedule():
             a.end_time
         FROM admin_schedules a
         JOIN users u ON a.admin_id = u.id
-        WHERE a.work_date >= CURRENT_DATE
-        ORDER BY a.work_date, a.start_time
+        WHERE a.work_day >= ?
+        ORDER BY a.work_day, a.start_minute
         LIMIT 50
-        """
+        """,
+        to_day(date.today())
     )
     
     # Get time slots for dropdown
@@ -365,29 +398,8 @@ def admin_schedule():
         time_slots.append(current_time.strftime("%H:%M"))
         current_time += interval
     
-    # Get working hours for each day of the week
-    working_hours = db.execute("SELECT * FROM working_hours ORDER BY day_of_week")
-    
-    # Create a dictionary for easier access in template
-    days_of_week = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
-    hours_by_day = {}
-    
-    for day in range(7):
-        hours_by_day[day] = {
-            "name": days_of_week[day],
-            "open_time": "09:00",
-            "close_time": "17:00",
-            "is_open": True
-        }
-    
-    for hours in working_hours:
-        day = hours["day_of_week"]
-        hours_by_day[day] = {
-            "name": days_of_week[day],
-            "open_time": hours["open_time"],
-            "close_time": hours["close_time"],
-            "is_open": hours["is_open"]
-        }
+    # Working hours of every day of the week, with defaults for days that aren't set
+    hours_by_day = get_working_hours(db).hours_by_day()
     
     # Get current month for calendar
     today = datetime.now()
@@ -481,31 +493,36 @@ def edit_staff_info():
         if role != current_role:
             db.execute("UPDATE users SET role = ? WHERE id = ?", role, user_id)
             db.execute("UPDATE user_info SET role = ? WHERE id = ?", role, user_id)
+            invalidate_user(user_id)
         
         flash("Staff information updated successfully!", "success")
         return redirect("/owner/edit_staff_info")
     
     # Get all staff members (excluding customers)
     if search_query:
-        # Search in multiple fields
-        staff = db.execute(
-            """
-            SELECT u.id, u.username, ui.* 
-            FROM users u 
-            JOIN user_info ui ON u.id = ui.id 
-            WHERE u.role != 'customer' 
-            AND (u.username LIKE ? OR ui.name LIKE ? OR ui.surname LIKE ? OR ui.email LIKE ?)
-            ORDER BY u.role, ui.surname, ui.name
-            """, 
-            f"%{search_query}%", f"%{search_query}%", f"%{search_query}%", f"%{search_query}%"
+        # Search in multiple fields, best matches first
+        staff_ids = search_users(
+            db, search_query, ["owner", "admin", "instructor"], ["username", "name", "surname", "email"]
         )
+        staff = []
+        if staff_ids:
+            staff = db.execute(
+                f"""
+                SELECT u.id, u.username, ui.* 
+                FROM users u 
+                JOIN user_info ui ON u.id = ui.id 
+                WHERE u.id IN ({", ".join(["?"] * len(staff_ids))})
+                """, 
+                *staff_ids
+            )
+            staff = in_rank_order(staff, staff_ids)
     else:
         staff = db.execute(
             """
             SELECT u.id, u.username, ui.* 
             FROM users u 
             JOIN user_info ui ON u.id = ui.id 
-            WHERE u.role != 'customer'
+            WHERE u.role IN ('owner', 'admin', 'instructor')
             ORDER BY u.role, ui.surname, ui.name
             """
         )
@@ -568,8 +585,27 @@ def delete_user():
             flash("You cannot delete your own account!", "danger")
             return render_template("owner/delete_user.html")
 
-        # Delete the user from the database
-        db.execute("DELETE FROM users WHERE username = ?", username)
+        # Booked lessons of the user are deleted with them and no longer take up instructor time,
+        # so their days are recomputed in the same transaction
+        user_id = user_to_delete[0]["id"]
+        with db.transaction("IMMEDIATE"):
+            booked_lessons = db.execute(
+                "SELECT instructor_id, lesson_date FROM lessons WHERE customer_id = ? AND status = 'booked'",
+                user_id
+            )
+            days = {(lesson["instructor_id"], lesson["lesson_date"]) for lesson in booked_lessons}
+            
+            # Delete the user from the database
+            db.execute("DELETE FROM users WHERE username = ?", username)
+            refresh_availability_days(db, days)
+        
+        invalidate_user(user_id)
+        for instructor_id, lesson_date in days:
+            invalidate_availability(instructor_id, lesson_date)
+        
+        # An instructor's availability is deleted with them
+        if user_to_delete[0]["role"] == "instructor":
+            availability_cache.clear()
 
         flash(f"User {username} has been deleted successfully.", "success")
         return render_template("owner/delete_user.html")
@@ -614,3 +650,75 @@ def add_user():
         return redirect("/owner/add_user")
 
     return render_template("/owner/add_user.html")
+
+
+@owner_bp.route("/data_transfer")
+@login_required
+def owner_data_transfer():
+    """Export and import lessons and time requests"""
+
+    # Ensure the current user is an owner
+    if current_user.role != "owner":
+        flash("You don't have permission to access this page", "danger")
+        return redirect("/")
+
+    return render_template("owner/data_transfer.html", tables=list(TABLES), formats=list(MIMETYPES))
+
+@owner_bp.route("/export/<table>")
+@login_required
+def owner_export(table):
+    """Stream a whole table as CSV or NDJSON"""
+
+    # Ensure the current user is an owner
+    if current_user.role != "owner":
+        flash("You don't have permission to access this page", "danger")
+        return redirect("/")
+
+    fmt = request.args.get("format", "csv")
+    if table not in TABLES or fmt not in MIMETYPES:
+        return "Unknown table or format", 404
+
+    # Written to the client batch by batch while the table is read
+    return Response(
+        stream_with_context(export_table(db, table, fmt)),
+        mimetype=MIMETYPES[fmt],
+        headers={"Content-Disposition": f"attachment; filename={table}.{fmt}"}
+    )
+
+@owner_bp.route("/import/<table>", methods=["POST"])
+@login_required
+def owner_import(table):
+    """Import a CSV or NDJSON file into a table"""
+
+    # Ensure the current user is an owner
+    if current_user.role != "owner":
+        flash("You don't have permission to access this page", "danger")
+        return redirect("/")
+
+    if table not in TABLES:
+        flash("Unknown table", "danger")
+        return redirect("/owner/data_transfer")
+
+    upload = request.files.get("file")
+    if not upload or not upload.filename:
+        flash("Please choose a file to import", "danger")
+        return redirect("/owner/data_transfer")
+
+    fmt = request.form.get("format") or transfer_format(upload.filename)
+    if fmt not in MIMETYPES:
+        flash("Unknown file format", "danger")
+        return redirect("/owner/data_transfer")
+
+    # Read straight from the upload (werkzeug keeps large files on disk) record by record
+    file = io.TextIOWrapper(upload.stream, encoding="utf-8-sig", newline="")
+    try:
+        count = import_table(db, table, file, fmt)
+    except TransferError as e:
+        flash(f"Nothing was imported. {e}", "danger")
+        return redirect("/owner/data_transfer")
+    except UnicodeDecodeError:
+        flash("Nothing was imported. The file must be UTF-8 text", "danger")
+        return redirect("/owner/data_transfer")
+
+    flash(f"Imported {count} row(s) into {table}", "success")
+    return redirect("/owner/data_transfer")
@@ -0,0 +1,76 @@
+import sqlite3
+
+from availability import claim_availability, invalidate_availability
+from days import to_day
+
+########################### Booking ##################################
+
+# A lesson is booked in one BEGIN IMMEDIATE transaction that checks the instructor's
+# lessons and free time, inserts the lesson and removes its time from the availability
+# table. IMMEDIATE takes SQLite's write lock at BEGIN, so two bookings of the same slot
+# run one after the other (the second waits at most busy_timeout): the second one sees
+# the first lesson and fails instead of both succeeding.
+#
+# The lessons_no_overlap triggers (see migrations.py) reject a booked lesson that
+# overlaps another one of the instructor, whatever code writes it.
+
+# Message of the trigger, to tell its error apart from other constraint errors
+OVERLAP_ERROR = "lesson overlaps a booked lesson"
+
+
+class BookingError(ValueError):
+    """The lesson can't be booked; the message is meant for the user"""
+
+
+def lesson_overlaps(db, instructor_id, date, start, end):
+    """Check if the instructor has a booked lesson overlapping [start, end) (in minutes) on date
+
+    One search of the (instructor_id, lesson_day, status, start_minute, end_minute) index.
+    """
+    return bool(db.execute(
+        """
+        SELECT 1 FROM lessons
+        WHERE instructor_id = ? AND lesson_day = ? AND status = 'booked'
+        AND start_minute < ? AND end_minute > ?
+        LIMIT 1
+        """,
+        instructor_id, to_day(date), end, start
+    ))
+
+
+def book_lesson(db, instructor_id, customer_id, date, start, end, notes=""):
+    """Books a lesson from start to end (in minutes) on date ('YYYY-MM-DD'), returns its id
+
+    Raises BookingError when the instructor has a lesson at that time, isn't free for the
+    whole lesson or the database stays locked by other writers.
+    """
+    try:
+        with db.transaction("IMMEDIATE"):
+            if lesson_overlaps(db, instructor_id, date, start, end):
+                raise BookingError("The instructor already has a lesson booked for this time")
+
+            if not claim_availability(db, instructor_id, date, start, end):
+                raise BookingError("The selected instructor is not available at this time")
+
+            lesson_id = db.execute(
+                """
+                INSERT INTO lessons
+                (customer_id, instructor_id, lesson_day, start_minute, end_minute, notes, status, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, 'booked', datetime('now'))
+                """,
+                customer_id, instructor_id, to_day(date), start, end, notes
+            )
+    except BookingError:
+        raise
+    except ValueError as e:
+        if OVERLAP_ERROR in str(e):
+            raise BookingError("The instructor already has a lesson booked for this time") from e
+        raise
+    except sqlite3.OperationalError as e:
+        if "locked" in str(e):
+            raise BookingError("Too many bookings at once, please try again") from e
+        raise
+
+    # Only after the commit, so nothing is cached for a booking that was rolled back
+    invalidate_availability(instructor_id, date)
+    return lesson_id
@@ -0,0 +1,179 @@
+from collections import Counter, OrderedDict
+import threading
+from time import monotonic
+
+########################### In-process caches ##################################
+
+class VersionedLRUCache:
+    """
+    Bounded least-recently-used cache where every entry belongs to a version key.
+
+    Writers call invalidate(version_key) to drop every value computed for that key; a
+    value that was invalidated while it was being computed is returned but not stored.
+
+    Several values can share a version key (e.g. free time and slots of the same
+    instructor day) by passing a different kind to get_or_compute.
+
+    With ttl (seconds), entries also expire that long after they were computed, for
+    values other processes can change without invalidating this cache.
+
+    Memory is bounded by max_entries: invalidate() removes the key's entries instead of
+    keeping a version counter per key, and only remembers when a key was invalidated
+    while a computation that started before it is still running.
+    """
+
+    def __init__(self, max_entries=1024, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # Kinds stored per version key, so invalidate() finds the key's entries
+        self._kinds = {}
+        # Every invalidate() and clear() advances the tick; computations remember the
+        # tick they started at, and _invalidated the tick of recent invalidations
+        self._tick = 0
+        self._cleared = 0
+        self._invalidated = {}
+        self._running = Counter()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _lookup(self, entry_key, now):
+        """Returns (True, value) for a live entry, else (False, None); called with the lock held"""
+        entry = self._entries.get(entry_key)
+        if entry is not None and (entry[1] is None or entry[1] > now):
+            self._entries.move_to_end(entry_key)
+            self.hits += 1
+            return True, entry[0]
+        self.misses += 1
+        return False, None
+
+    def _start(self):
+        """Registers a computation and returns its start tick; called with the lock held"""
+        self._running[self._tick] += 1
+        return self._tick
+
+    def _finish(self, started):
+        """Unregisters a computation and forgets invalidations no running one needs; called with the lock held"""
+        self._running[started] -= 1
+        if not self._running[started]:
+            del self._running[started]
+
+        if not self._running:
+            self._invalidated.clear()
+        elif len(self._invalidated) > self.max_entries:
+            oldest = min(self._running)
+            self._invalidated = {key: tick for key, tick in self._invalidated.items() if tick > oldest}
+
+    def _store(self, version_key, kind, value, started, expires):
+        """Stores value unless version_key was invalidated after started; called with the lock held"""
+        if self._cleared > started or self._invalidated.get(version_key, 0) > started:
+            return
+
+        entry_key = (version_key, kind)
+        self._entries[entry_key] = (value, expires)
+        self._entries.move_to_end(entry_key)
+        self._kinds.setdefault(version_key, set()).add(kind)
+
+        while len(self._entries) > self.max_entries:
+            (evicted_key, evicted_kind), _ = self._entries.popitem(last=False)
+            self._discard_kind(evicted_key, evicted_kind)
+            self.evictions += 1
+
+    def _discard_kind(self, version_key, kind):
+        """Forgets that (version_key, kind) is stored; called with the lock held"""
+        kinds = self._kinds.get(version_key)
+        if kinds is not None:
+            kinds.discard(kind)
+            if not kinds:
+                del self._kinds[version_key]
+
+    def get_or_compute(self, version_key, compute, kind=None):
+        """Returns the cached value for (version_key, kind), calling compute() on a miss"""
+        with self._lock:
+            found, value = self._lookup((version_key, kind), monotonic())
+            if found:
+                return value
+            started = self._start()
+
+        expires = monotonic() + self.ttl if self.ttl is not None else None
+        try:
+            value = compute()
+        except BaseException:
+            with self._lock:
+                self._finish(started)
+            raise
+
+        with self._lock:
+            self._store(version_key, kind, value, started, expires)
+            self._finish(started)
+
+        return value
+
+    def get_many_or_compute(self, version_keys, compute_missing, kind=None):
+        """Returns {version_key: value} for version_keys, calling compute_missing(missing keys) once for the misses
+
+        compute_missing returns {version_key: value} for the keys it was given.
+        """
+        found = {}
+        missing = []
+        now = monotonic()
+
+        with self._lock:
+            for version_key in version_keys:
+                hit, value = self._lookup((version_key, kind), now)
+                if hit:
+                    found[version_key] = value
+                else:
+                    missing.append(version_key)
+            if not missing:
+                return found
+            started = self._start()
+
+        expires = monotonic() + self.ttl if self.ttl is not None else None
+        try:
+            computed = compute_missing(missing)
+        except BaseException:
+            with self._lock:
+                self._finish(started)
+            raise
+
+        with self._lock:
+            for version_key in missing:
+                found[version_key] = computed[version_key]
+                self._store(version_key, kind, computed[version_key], started, expires)
+            self._finish(started)
+
+        return found
+
+    def invalidate(self, version_key):
+        """Drops every value computed for version_key, including ones being computed now"""
+        with self._lock:
+            self._tick += 1
+            for kind in self._kinds.pop(version_key, ()):
+                del self._entries[(version_key, kind)]
+            if self._running:
+                self._invalidated[version_key] = self._tick
+
+    def clear(self):
+        """Invalidates every version key at once and drops every entry"""
+        with self._lock:
+            self._tick += 1
+            self._cleared = self._tick
+            self._entries.clear()
+            self._kinds.clear()
+            self._invalidated.clear()
+
+    def stats(self):
+        """Returns hit/miss/eviction counters and the current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0,
+                "size": len(self._entries),
+                "max_entries": self.max_entries
+            }
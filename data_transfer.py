@@ -0,0 +1,267 @@
+import csv
+import io
+import json
+import os
+
+from availability import invalidate_availability, refresh_availability_days
+from days import to_day, to_iso
+from intervals import to_minutes
+
+########################### Export and import of lessons and time requests ##################################
+
+# Lessons and time requests are exported as CSV or NDJSON (one JSON object per line) with
+# dates as 'YYYY-MM-DD' and times as 'HH:MM', the same text the web forms use. Exports
+# are generators that read the table in batches of EXPORT_BATCH_SIZE rows by id, so a
+# response or file is written while the table is read and memory doesn't grow with the
+# table. Batches are separate statements: rows written during an export may or may not
+# be in it.
+#
+# An import reads the file record by record and inserts IMPORT_BATCH_SIZE rows per
+# executemany, all in one BEGIN IMMEDIATE transaction: the file is imported whole or not
+# at all. Imported rows get new ids (an id column in the file is ignored), customers,
+# instructors and admins are referenced by their ids here, and booked lessons still go
+# through the lessons_no_overlap triggers. The instructor days of imported booked lessons
+# and approved requests are recomputed in the availability table at the end of the same
+# transaction, and their cache is invalidated after the commit.
+
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 1000))
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", 1000))
+
+MIMETYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson"
+}
+
+
+class TransferError(ValueError):
+    """The file can't be imported; the message says which record and why"""
+
+
+def _minute_range(record):
+    """(start, end) in minutes of a record's start_time and end_time"""
+    start, end = to_minutes(record["start_time"]), to_minutes(record["end_time"])
+    if end <= start:
+        raise ValueError("end_time must be after start_time")
+    return start, end
+
+
+def _lesson_values(record):
+    """INSERT parameters of one lesson record"""
+    return (
+        int(record["customer_id"]),
+        int(record["instructor_id"]),
+        to_day(record["lesson_date"]),
+        *_minute_range(record),
+        record.get("status") or "booked",
+        record.get("notes") or "",
+        record.get("created_at") or None
+    )
+
+
+def _time_request_values(record):
+    """INSERT parameters of one time request record"""
+    admin_id = record.get("admin_id")
+    return (
+        int(record["instructor_id"]),
+        to_day(record["request_date"]),
+        *_minute_range(record),
+        record["request_type"],
+        record.get("status") or "pending",
+        record.get("reason") or None,
+        int(admin_id) if admin_id not in (None, "") else None,
+        record.get("created_at") or None,
+        record.get("processed_at") or None,
+        record.get("admin_note") or None
+    )
+
+
+def _lesson_day(values):
+    """(instructor_id, date) whose availability an imported lesson changes, None if it isn't booked"""
+    return (values[1], to_iso(values[2])) if values[5] == "booked" else None
+
+
+def _time_request_day(values):
+    """(instructor_id, date) whose availability an imported time request changes, None if it isn't approved"""
+    return (values[0], to_iso(values[1])) if values[5] == "approved" else None
+
+
+# Per table: exported columns (id first), the batch query, the INSERT, the record converter
+# and the instructor day a row changes
+TABLES = {
+    "lessons": {
+        "columns": [
+            "id", "customer_id", "instructor_id", "lesson_date", "start_time", "end_time",
+            "status", "notes", "created_at"
+        ],
+        "select": """
+            SELECT id, customer_id, instructor_id, lesson_date, start_time, end_time, status, notes, created_at
+            FROM lessons WHERE id > ? ORDER BY id LIMIT ?
+        """,
+        "insert": """
+            INSERT INTO lessons
+            (customer_id, instructor_id, lesson_day, start_minute, end_minute, status, notes, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))
+        """,
+        "values": _lesson_values,
+        "day": _lesson_day
+    },
+    "time_requests": {
+        "columns": [
+            "id", "instructor_id", "request_date", "start_time", "end_time", "request_type",
+            "status", "reason", "admin_id", "created_at", "processed_at", "admin_note"
+        ],
+        "select": """
+            SELECT id, instructor_id, request_date, start_time, end_time, request_type,
+            status, reason, admin_id, created_at, processed_at, admin_note
+            FROM time_requests WHERE id > ? ORDER BY id LIMIT ?
+        """,
+        "insert": """
+            INSERT INTO time_requests
+            (instructor_id, request_day, start_minute, end_minute, request_type,
+            status, reason, admin_id, created_at, processed_at, admin_note)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?, ?)
+        """,
+        "values": _time_request_values,
+        "day": _time_request_day
+    }
+}
+
+
+def transfer_format(filename, default="csv"):
+    """Picks 'csv' or 'ndjson' from a file name"""
+    if filename and filename.lower().endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    if filename and filename.lower().endswith(".csv"):
+        return "csv"
+    return default
+
+
+########################### Export ##################################
+
+def export_batches(db, table, batch_size=EXPORT_BATCH_SIZE):
+    """Yields the rows of table as lists of tuples of at most batch_size rows, in id order"""
+    sql = TABLES[table]["select"]
+    last_id = 0
+    while True:
+        rows = db.execute(sql, last_id, batch_size, result="tuple")
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def export_csv(db, table, batch_size=EXPORT_BATCH_SIZE):
+    """Yields the table as CSV text: the header line, then one chunk per batch of rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow(TABLES[table]["columns"])
+    for rows in export_batches(db, table, batch_size):
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    # Header only, for an empty table
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_ndjson(db, table, batch_size=EXPORT_BATCH_SIZE):
+    """Yields the table as NDJSON text, one chunk per batch of rows"""
+    columns = TABLES[table]["columns"]
+    for rows in export_batches(db, table, batch_size):
+        yield "".join(json.dumps(dict(zip(columns, row))) + "\n" for row in rows)
+
+
+def export_table(db, table, fmt="csv", batch_size=EXPORT_BATCH_SIZE):
+    """Yields the table as text in fmt ('csv' or 'ndjson')"""
+    if fmt == "ndjson":
+        return export_ndjson(db, table, batch_size)
+    return export_csv(db, table, batch_size)
+
+
+########################### Import ##################################
+
+def read_csv(file):
+    """Yields the records of a CSV text file with a header line as dicts"""
+    reader = csv.DictReader(file)
+    try:
+        yield from reader
+    except csv.Error as e:
+        raise TransferError(f"Line {reader.line_num}: {e}") from e
+
+
+def read_ndjson(file):
+    """Yields the records of an NDJSON text file as dicts, skipping blank lines"""
+    for number, line in enumerate(file, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise TransferError(f"Line {number}: {e}") from e
+        if not isinstance(record, dict):
+            raise TransferError(f"Line {number}: expected a JSON object")
+        yield record
+
+
+def _record_error(number, error):
+    """Message for a record that can't be converted"""
+    if isinstance(error, KeyError):
+        return f"Record {number}: missing {error.args[0]}"
+    return f"Record {number}: {error}"
+
+
+def import_records(db, table, records, batch_size=IMPORT_BATCH_SIZE):
+    """Inserts records (dicts with the exported columns) into table, returns the number of rows inserted
+
+    Raises TransferError, and nothing is imported, when a record is invalid or breaks a
+    constraint.
+    """
+    spec = TABLES[table]
+    count = 0
+    number = 0
+    days = set()
+
+    with db.transaction("IMMEDIATE"):
+        batch = []
+        for record in records:
+            number += 1
+            try:
+                values = spec["values"](record)
+            except (KeyError, ValueError, TypeError, AttributeError) as e:
+                raise TransferError(_record_error(number, e)) from e
+
+            batch.append(values)
+            day = spec["day"](values)
+            if day:
+                days.add(day)
+
+            if len(batch) == batch_size:
+                count += _insert_batch(db, spec["insert"], batch, number)
+                batch = []
+
+        if batch:
+            count += _insert_batch(db, spec["insert"], batch, number)
+
+        refresh_availability_days(db, days)
+
+    for instructor_id, date in days:
+        invalidate_availability(instructor_id, date)
+
+    return count
+
+
+def _insert_batch(db, sql, batch, last_number):
+    """Inserts one batch; constraint errors name the batch's records since executemany can't say which row failed"""
+    try:
+        return db.executemany(sql, batch)
+    except ValueError as e:
+        raise TransferError(f"Records {last_number - len(batch) + 1}-{last_number}: {e}") from e
+
+
+def import_table(db, table, file, fmt="csv", batch_size=IMPORT_BATCH_SIZE):
+    """Imports a CSV or NDJSON text file into table, returns the number of rows inserted"""
+    records = read_ndjson(file) if fmt == "ndjson" else read_csv(file)
+    return import_records(db, table, records, batch_size)
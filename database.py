@@ -0,0 +1,176 @@
+from contextlib import contextmanager
+from datetime import date, datetime, time
+import os
+import queue
+import sqlite3
+import threading
+from time import perf_counter
+
+########################### Database connection ##################################
+
+# The app and every blueprint share this one Database object, and with it one pool of
+# SQLite connections. Each connection is configured once when the pool opens it:
+#   - WAL journal so readers don't block the writer and the writer doesn't block readers
+#   - busy_timeout so a writer waits for the lock instead of failing with "database is locked"
+#   - synchronous=NORMAL, which is safe with WAL and avoids an fsync on every commit
+#   - a larger page cache and memory-mapped reads
+#   - foreign keys, so ON DELETE CASCADE works
+
+DATABASE_PATH = os.environ.get("DATABASE_PATH", "database.db")
+BUSY_TIMEOUT_MS = int(os.environ.get("DATABASE_BUSY_TIMEOUT_MS", 5000))
+CACHE_SIZE_KB = int(os.environ.get("DATABASE_CACHE_SIZE_KB", 64 * 1024))
+MMAP_SIZE = int(os.environ.get("DATABASE_MMAP_SIZE", 256 * 1024 * 1024))
+POOL_SIZE = int(os.environ.get("DATABASE_POOL_SIZE", 8))
+CACHED_STATEMENTS = int(os.environ.get("DATABASE_CACHED_STATEMENTS", 512))
+
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+    "PRAGMA synchronous = NORMAL",
+    f"PRAGMA cache_size = -{CACHE_SIZE_KB}",
+    f"PRAGMA mmap_size = {MMAP_SIZE}",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA foreign_keys = ON"
+]
+
+
+def connect(path=DATABASE_PATH):
+    """Opens a configured SQLite connection"""
+
+    # isolation_level=None leaves transactions to explicit BEGIN/COMMIT like cs50.SQL did.
+    # sqlite3 keeps the prepared statements of the last CACHED_STATEMENTS queries, so
+    # repeated queries skip SQLite's parser as well.
+    connection = sqlite3.connect(
+        path,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        isolation_level=None,
+        check_same_thread=False,
+        cached_statements=CACHED_STATEMENTS
+    )
+    for pragma in PRAGMAS:
+        connection.execute(pragma)
+    return connection
+
+
+def _adapt(value):
+    """Formats dates and times the way they are stored in the database"""
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, date):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, time):
+        return value.strftime("%H:%M:%S")
+    return value
+
+
+class Database:
+    """
+    Runs queries directly on sqlite3 with the call shape of cs50.SQL:
+
+        db.execute("SELECT * FROM users WHERE id = ?", user_id)
+
+    returns a list of dicts for statements that return rows, the new row id for an
+    INSERT of one row, the number of changed rows for UPDATE and DELETE and True for
+    anything else. result="tuple" or result="row" (sqlite3.Row) skip building dicts.
+    executemany() runs one statement for many rows of parameters, for bulk writes.
+
+    A connection is taken from the pool for each statement, except between BEGIN and
+    COMMIT/ROLLBACK where the thread keeps its connection (see transaction()).
+
+    on_query, when set, is called with (sql, seconds) after every statement, e.g. to
+    collect per-request statistics (see query_stats.py).
+    """
+
+    def __init__(self, path=DATABASE_PATH, pool_size=POOL_SIZE):
+        self.path = path
+        self.pool_size = pool_size
+        self.on_query = None
+        self._pool = queue.LifoQueue()
+        self._local = threading.local()
+
+    def _checkout(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            return connection
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return connect(self.path)
+
+    def _checkin(self, connection):
+        if getattr(self._local, "connection", None) is connection:
+            return
+        if self._pool.qsize() < self.pool_size:
+            self._pool.put(connection)
+        else:
+            connection.close()
+
+    def execute(self, sql, *args, result="dict"):
+        """Runs one statement with ? parameters"""
+        command = sql.lstrip()[:8].split(None, 1)[0].upper()
+        connection = self._checkout()
+        started = perf_counter()
+
+        try:
+            cursor = connection.cursor()
+            if result == "row":
+                cursor.row_factory = sqlite3.Row
+
+            try:
+                cursor.execute(sql, [_adapt(arg) for arg in args])
+            except sqlite3.IntegrityError as e:
+                # cs50.SQL raised ValueError for constraint violations
+                raise ValueError(str(e)) from e
+
+            # The thread keeps its connection until the transaction ends
+            if command == "BEGIN":
+                self._local.connection = connection
+            elif command in ("COMMIT", "END", "ROLLBACK"):
+                self._local.connection = None
+
+            if cursor.description is not None:
+                rows = cursor.fetchall()
+                if result == "dict":
+                    names = [column[0] for column in cursor.description]
+                    return [dict(zip(names, row)) for row in rows]
+                return rows
+
+            if command in ("INSERT", "REPLACE"):
+                return cursor.lastrowid if cursor.rowcount == 1 else None
+            if command in ("UPDATE", "DELETE"):
+                return cursor.rowcount
+            return True
+        finally:
+            self._checkin(connection)
+            if self.on_query is not None:
+                self.on_query(sql, perf_counter() - started)
+
+    def executemany(self, sql, rows):
+        """Runs one INSERT/UPDATE/DELETE for every tuple of parameters in rows, returns the number of changed rows"""
+        connection = self._checkout()
+        started = perf_counter()
+
+        try:
+            try:
+                cursor = connection.executemany(sql, ([_adapt(arg) for arg in row] for row in rows))
+            except sqlite3.IntegrityError as e:
+                raise ValueError(str(e)) from e
+            return cursor.rowcount
+        finally:
+            self._checkin(connection)
+            if self.on_query is not None:
+                self.on_query(sql, perf_counter() - started)
+
+    @contextmanager
+    def transaction(self, mode="DEFERRED"):
+        """Runs the statements of a with block in one transaction (BEGIN DEFERRED/IMMEDIATE/EXCLUSIVE)"""
+        self.execute(f"BEGIN {mode}")
+        try:
+            yield self
+            self.execute("COMMIT")
+        except BaseException:
+            self.execute("ROLLBACK")
+            raise
+
+
+db = Database()
@@ -0,0 +1,99 @@
+from intervals import iter_slots
+
+########################### Bitset day grid ##################################
+
+# A day is split into 5-minute cells and an instructor's day is stored as a single
+# integer where bit n is set when cell n (minutes n*5 to n*5+5) is free.
+# Opening time is an OR, closing time and booking lessons are an AND-NOT and
+# checking a slot is one mask test.
+#
+# Times that are not on the 5-minute grid are rounded so that availability is never
+# overstated: opened time only covers the cells that lie fully inside it, while
+# closed/booked time and checked slots cover every cell they touch.
+
+CELL_MINUTES = 5
+CELLS_PER_DAY = 24 * 60 // CELL_MINUTES
+FULL_DAY = (1 << CELLS_PER_DAY) - 1
+
+
+def span_mask(start, end):
+    """Mask of every cell that [start, end) touches (minutes since midnight)"""
+    first = start // CELL_MINUTES
+    last = -(-end // CELL_MINUTES)
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+def inner_mask(start, end):
+    """Mask of the cells that lie fully inside [start, end) (minutes since midnight)"""
+    first = -(-start // CELL_MINUTES)
+    last = end // CELL_MINUTES
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+def open_grid(time_requests):
+    """Processes time_requests (ordered by processed_at, id) into a grid of open cells"""
+    grid = 0
+
+    for req in time_requests:
+        if req["request_type"] == "open":
+            grid |= inner_mask(req["start_minute"], req["end_minute"])
+        elif req["request_type"] == "close":
+            grid &= ~span_mask(req["start_minute"], req["end_minute"])
+
+    return grid
+
+
+def booked_grid(lessons):
+    """Marks every cell touched by the given lessons"""
+    grid = 0
+    for lesson in lessons:
+        grid |= span_mask(lesson["start_minute"], lesson["end_minute"])
+    return grid
+
+
+def is_free(grid, start, end):
+    """Check if every cell of [start, end) is set in the grid"""
+    needed = span_mask(start, end)
+    return needed != 0 and grid & needed == needed
+
+
+def overlaps(grid, start, end):
+    """Check if any cell of [start, end) is set in the grid"""
+    return grid & span_mask(start, end) != 0
+
+
+def to_ranges(grid):
+    """Converts a grid back to interval boundaries (see intervals.py)"""
+    ranges = []
+    while grid:
+        # Position of the lowest set bit and the length of the run of ones starting there
+        first = (grid & -grid).bit_length() - 1
+        shifted = grid >> first
+        run = (~shifted & (shifted + 1)).bit_length() - 1
+
+        ranges += [first * CELL_MINUTES, (first + run) * CELL_MINUTES]
+        grid &= ~(((1 << run) - 1) << first)
+    return ranges
+
+
+def slot_starts(grid, duration, step):
+    """Grid with a bit set for every cell where a slot of the given duration starts
+
+    Slots step from the start of each free range, like intervals.iter_slots
+    """
+    starts = 0
+    for slot_start, _ in iter_slots(to_ranges(grid), duration, step):
+        starts |= 1 << (slot_start // CELL_MINUTES)
+    return starts
+
+
+def iter_cells(grid):
+    """Yield the start minute of every set cell, in ascending order"""
+    while grid:
+        lowest = grid & -grid
+        yield (lowest.bit_length() - 1) * CELL_MINUTES
+        grid ^= lowest
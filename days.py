@@ -0,0 +1,29 @@
+from datetime import date
+
+########################### Day numbers ##################################
+
+# Dates of lessons, time requests, admin schedules and availability are stored as day
+# numbers: whole days since 1970-01-01 (like Unix time in days). Ranges of days are then
+# plain integer comparisons, and the 'YYYY-MM-DD' text is only made for display (see
+# migrations.py for the generated columns that keep the old text columns readable).
+
+EPOCH = date(1970, 1, 1)
+EPOCH_ORDINAL = EPOCH.toordinal()
+
+
+def to_day(value):
+    """Convert a date or a 'YYYY-MM-DD' string to a day number"""
+    if isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    return value.toordinal() - EPOCH_ORDINAL
+
+
+def to_date(day):
+    """Convert a day number to a date"""
+    return date.fromordinal(day + EPOCH_ORDINAL)
+
+
+def to_iso(day):
+    """Convert a day number to a 'YYYY-MM-DD' string"""
+    return to_date(day).isoformat()
+
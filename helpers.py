@@ -1,50 +1,86 @@
-from datetime import datetime, timedelta
 from werkzeug.utils import secure_filename
 import time
 import os
 
+from intervals import iter_slots, HHMM_LABELS, DISPLAY_LABELS
+from daygrid import iter_cells
+
 ########################### Functions that repeat ##################################
 
-# Function to calculate the open time ranges
-def open_time_ranges(time_requests):
-    """Processes time_requests to compute merged open ranges"""
-    open_ranges = []
+# Function to turn free ranges into bookable time slots for the JSON endpoints
+def time_slots(free_ranges, duration=60, step=30):
+    """Splits free ranges into slots of the given duration (in minutes)"""
+    return [
+        {
+            "start_time": HHMM_LABELS[start],
+            "end_time": HHMM_LABELS[end],
+            "display": f"{DISPLAY_LABELS[start]} - {DISPLAY_LABELS[end]}"
+        }
+        for start, end in iter_slots(free_ranges, duration, step)
+    ]
+
+# Function to turn a grid of slot start cells (see daygrid.slot_starts) into time slots
+def time_slots_from_starts(starts, duration=60):
+    """Lists slots of the given duration (in minutes) for every start cell, sorted by start time"""
+    return [
+        {
+            "start_time": HHMM_LABELS[start],
+            "end_time": HHMM_LABELS[start + duration],
+            "display": f"{DISPLAY_LABELS[start]} - {DISPLAY_LABELS[start + duration]}"
+        }
+        for start in iter_cells(starts)
+    ]
+
+# Function to build the instructors x time slots grid of the admin schedule
+def schedule_grid(instructor_ids, first_slot, slot_count, time_requests, lessons, step=30):
+    """
+    Builds {instructor_id: {"HH:MM": {"status": ..., "lesson": ...}}} for slot_count slots
+    of step minutes starting at first_slot (minutes since midnight). time_requests and
+    lessons have start_minute and end_minute.
+
+    A slot takes the status of the time requests (ordered by processed_at, id) and lessons
+    that cover its start time. The grid is one bytearray row per instructor where each
+    request or lesson paints a whole slice at once.
+    """
+    CLOSED, OPEN, BOOKED = 0, 1, 2
+    statuses = ["closed", "open", "booked"]
+
+    rows = {instructor_id: row for row, instructor_id in enumerate(instructor_ids)}
+    grid = bytearray(len(rows) * slot_count)
+    lesson_at = [None] * len(grid)
+
+    def covered(start, end):
+        """First and last (exclusive) grid index of the slots whose start lies in [start, end)"""
+        first = max(0, -(-(start - first_slot) // step))
+        last = min(slot_count, -(-(end - first_slot) // step))
+        return first, max(first, last)
 
     for req in time_requests:
-        start = datetime.strptime(req["start_time"], "%H:%M").time()
-        end = datetime.strptime(req["end_time"], "%H:%M").time()
+        if req["instructor_id"] not in rows or req["request_type"] not in ("open", "close"):
+            continue
+        first, last = covered(req["start_minute"], req["end_minute"])
+        offset = rows[req["instructor_id"]] * slot_count
+        grid[offset + first:offset + last] = bytes([OPEN if req["request_type"] == "open" else CLOSED]) * (last - first)
 
-        if req["request_type"] == "open":
-            new_range = {"start": start, "end": end}
-            i = 0
-            while i < len(open_ranges):
-                existing = open_ranges[i]
-                if new_range["start"] <= existing["end"] and new_range["end"] >= existing["start"]:
-                    new_range["start"] = min(new_range["start"], existing["start"])
-                    new_range["end"] = max(new_range["end"], existing["end"])
-                    open_ranges.pop(i)
-                else:
-                    i += 1
-            open_ranges.append(new_range)
-            open_ranges.sort(key=lambda x: x["start"])
+    for lesson in lessons:
+        if lesson["instructor_id"] not in rows:
+            continue
+        first, last = covered(lesson["start_minute"], lesson["end_minute"])
+        offset = rows[lesson["instructor_id"]] * slot_count
+        grid[offset + first:offset + last] = bytes([BOOKED]) * (last - first)
+        lesson_at[offset + first:offset + last] = [lesson] * (last - first)
 
-        elif req["request_type"] == "close":
-            updated_ranges = []
-            for open_range in open_ranges:
-                s, e = open_range["start"], open_range["end"]
-                if start <= s and end >= e:
-                    continue
-                elif start > s and end < e:
-                    updated_ranges += [{"start": s, "end": start}, {"start": end, "end": e}]
-                elif start <= s < end < e:
-                    updated_ranges.append({"start": end, "end": e})
-                elif s < start < e <= end:
-                    updated_ranges.append({"start": s, "end": start})
-                else:
-                    updated_ranges.append(open_range)
-            open_ranges = updated_ranges
+    # Convert to the format used by the template once
+    labels = [HHMM_LABELS[first_slot + i * step] for i in range(slot_count)]
+    schedule = {}
+    for instructor_id, row in rows.items():
+        offset = row * slot_count
+        schedule[instructor_id] = {
+            labels[i]: {"status": statuses[grid[offset + i]], "lesson": lesson_at[offset + i]}
+            for i in range(slot_count)
+        }
 
-    return open_ranges
+    return schedule
 
 # Handle profile picture uploads
 def handle_profile_picture(file_field, user_id=None, old_picture=None):
@@ -0,0 +1,125 @@
+from bisect import bisect_left, bisect_right
+
+########################### Integer-minute interval engine ##################################
+
+# A set of time ranges within one day is kept as a flat, sorted list of boundaries
+# in minutes since midnight: [start_0, end_0, start_1, end_1, ...].
+# Ranges are half-open [start, end), never overlap and never touch (touching
+# ranges are merged), so every even index is a start and every odd index an end.
+#
+# The app computes availability with the bitset day grids of daygrid.py, which replaced
+# this engine there; these ranges stay exact to the minute and are the reference the
+# grid engine is checked against (see benchmarks/bench_availability.py).
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def to_minutes(value):
+    """Convert an 'HH:MM' string to minutes since midnight"""
+    hours, minutes = value.split(":")[:2]
+    return int(hours) * 60 + int(minutes)
+
+
+def to_hhmm(minutes):
+    """Convert minutes since midnight to an 'HH:MM' string"""
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def to_display(minutes):
+    """Convert minutes since midnight to a 12-hour string like '09:30 AM'"""
+    hours, minutes = divmod(minutes, 60)
+    suffix = "AM" if hours % 24 < 12 else "PM"
+    return f"{(hours - 1) % 12 + 1:02d}:{minutes:02d} {suffix}"
+
+
+# Labels of every minute of the day (and of midnight at its end), so listing slots is a
+# lookup per boundary instead of formatting each time
+HHMM_LABELS = [to_hhmm(minutes) for minutes in range(MINUTES_PER_DAY + 1)]
+DISPLAY_LABELS = [to_display(minutes) for minutes in range(MINUTES_PER_DAY + 1)]
+
+
+def add(ranges, start, end):
+    """Merge the range [start, end) into ranges (in place)"""
+    if start >= end:
+        return ranges
+
+    # Ranges that touch the new one are swallowed, so search the start from the left
+    # and the end from the right
+    i = bisect_left(ranges, start)
+    j = bisect_right(ranges, end)
+
+    # An even position means the boundary falls outside every existing range
+    new_boundaries = []
+    if i % 2 == 0:
+        new_boundaries.append(start)
+    if j % 2 == 0:
+        new_boundaries.append(end)
+
+    ranges[i:j] = new_boundaries
+    return ranges
+
+
+def subtract(ranges, start, end):
+    """Remove the range [start, end) from ranges (in place)"""
+    if start >= end:
+        return ranges
+
+    i = bisect_left(ranges, start)
+    j = bisect_right(ranges, end)
+
+    # An odd position means the boundary cuts through an existing range
+    new_boundaries = []
+    if i % 2 == 1:
+        new_boundaries.append(start)
+    if j % 2 == 1:
+        new_boundaries.append(end)
+
+    ranges[i:j] = new_boundaries
+    return ranges
+
+
+def merge(pairs):
+    """Build ranges from an iterable of (start, end) pairs"""
+    ranges = []
+    for start, end in sorted(pairs):
+        if start >= end:
+            continue
+        if ranges and start <= ranges[-1]:
+            if end > ranges[-1]:
+                ranges[-1] = end
+        else:
+            ranges += [start, end]
+    return ranges
+
+
+def contains(ranges, start, end):
+    """Check if [start, end) lies entirely inside one of the ranges"""
+    i = bisect_right(ranges, start)
+    return i % 2 == 1 and end <= ranges[i]
+
+
+def open_time_ranges(time_requests):
+    """Open ranges of time_requests (ordered by processed_at, id), applied one by one"""
+    open_ranges = []
+
+    for req in time_requests:
+        if req["request_type"] == "open":
+            add(open_ranges, req["start_minute"], req["end_minute"])
+        elif req["request_type"] == "close":
+            subtract(open_ranges, req["start_minute"], req["end_minute"])
+
+    return open_ranges
+
+
+def pairs(ranges):
+    """Iterate over ranges as (start, end) pairs"""
+    return zip(ranges[::2], ranges[1::2])
+
+
+def iter_slots(ranges, duration, step):
+    """Yield (start, end) of every slot of the given duration, stepping from each range start"""
+    for range_start, range_end in pairs(ranges):
+        slot_start = range_start
+        while slot_start + duration <= range_end:
+            yield slot_start, slot_start + duration
+            slot_start += step
@@ -0,0 +1,75 @@
+import os
+
+from daygrid import CELL_MINUTES
+from intervals import MINUTES_PER_DAY
+
+########################### Lesson length settings ##################################
+
+# Lessons are offered as slots of `duration` minutes, starting every `step` minutes from
+# the start of each free range. The school-wide setting is stored with instructor_id NULL
+# and an instructor can have their own; without any stored setting the defaults apply.
+# The table is created by the migrations (see migrations.py).
+
+DEFAULT_DURATION = int(os.environ.get("LESSON_DURATION", 60))
+DEFAULT_STEP = int(os.environ.get("LESSON_STEP", 30))
+
+
+def valid_lesson_settings(duration, step):
+    """Check that duration and step (in minutes) are whole cells of the day grid"""
+    return (
+        0 < duration <= MINUTES_PER_DAY and duration % CELL_MINUTES == 0
+        and 0 < step <= MINUTES_PER_DAY and step % CELL_MINUTES == 0
+    )
+
+
+def get_lesson_settings(db, instructor_id=None):
+    """Returns (duration, step) for an instructor, or the school-wide ones without an instructor"""
+    # The instructor's own setting sorts before the school-wide one
+    rows = db.execute(
+        """
+        SELECT duration, step FROM lesson_settings
+        WHERE instructor_id IS NULL OR instructor_id = ?
+        ORDER BY instructor_id IS NULL
+        LIMIT 1
+        """,
+        instructor_id
+    )
+
+    if not rows:
+        return DEFAULT_DURATION, DEFAULT_STEP
+    return rows[0]["duration"], rows[0]["step"]
+
+
+def all_lesson_settings(db):
+    """Returns the school-wide (duration, step) and {instructor_id: (duration, step)} of the overrides"""
+    school = (DEFAULT_DURATION, DEFAULT_STEP)
+    instructors = {}
+
+    for row in db.execute("SELECT instructor_id, duration, step FROM lesson_settings"):
+        if row["instructor_id"] is None:
+            school = (row["duration"], row["step"])
+        else:
+            instructors[row["instructor_id"]] = (row["duration"], row["step"])
+
+    return school, instructors
+
+
+def save_lesson_settings(db, duration, step, instructor_id=None):
+    """Stores the school-wide setting, or an instructor's own"""
+    if instructor_id is None:
+        existing = db.execute("SELECT id FROM lesson_settings WHERE instructor_id IS NULL")
+    else:
+        existing = db.execute("SELECT id FROM lesson_settings WHERE instructor_id = ?", instructor_id)
+
+    if existing:
+        db.execute("UPDATE lesson_settings SET duration = ?, step = ? WHERE id = ?", duration, step, existing[0]["id"])
+    else:
+        db.execute(
+            "INSERT INTO lesson_settings (instructor_id, duration, step) VALUES (?, ?, ?)",
+            instructor_id, duration, step
+        )
+
+
+def delete_lesson_settings(db, instructor_id):
+    """Removes an instructor's own setting so the school-wide one applies again"""
+    db.execute("DELETE FROM lesson_settings WHERE instructor_id = ?", instructor_id)
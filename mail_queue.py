@@ -0,0 +1,238 @@
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+import logging
+import os
+import smtplib
+import threading
+from time import monotonic
+
+########################### Outgoing mail queue ##################################
+
+# Requests don't talk to the mail server: enqueue_mail() stores the message in the
+# mail_queue table and wakes the mail worker, a background thread of the app process.
+# The worker sends due messages in batches of MAIL_BATCH_SIZE over one SMTP connection
+# that it keeps open between batches (and closes after MAIL_IDLE_SECONDS without mail).
+#
+# A message that fails is tried again after MAIL_RETRY_SECONDS, doubling after every
+# attempt, until MAIL_MAX_ATTEMPTS; then, or at once when the server rejects it for good
+# (a 5xx reply), it is kept with status 'failed' and the last error. Sent messages are
+# deleted, so reset links don't stay in the database.
+#
+# Messages are claimed for MAIL_LEASE_SECONDS inside a write transaction before they are
+# sent, so several app processes can run workers without sending a message twice, and
+# messages claimed by a process that died are sent after the lease runs out.
+#
+# SMTP_STARTTLS=0 and an empty SMTP_USERNAME send to a local SMTP server without TLS or
+# login, e.g. a test stand-in; `flask send-mail` delivers what is due without the worker.
+
+SMTP_SERVER = os.environ.get("SMTP_SERVER", "smtp.gmail.com")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", 587))
+SMTP_USERNAME = os.environ.get("SMTP_USERNAME", "")
+SMTP_PASSWORD = os.environ.get("SMTP_PASSWORD", "")
+SMTP_STARTTLS = os.environ.get("SMTP_STARTTLS", "1") == "1"
+SMTP_TIMEOUT = float(os.environ.get("SMTP_TIMEOUT", 30))
+FROM_EMAIL = os.environ.get("FROM_EMAIL", "noreply@skiresort.com")
+
+MAIL_BATCH_SIZE = int(os.environ.get("MAIL_BATCH_SIZE", 50))
+MAIL_MAX_ATTEMPTS = int(os.environ.get("MAIL_MAX_ATTEMPTS", 6))
+MAIL_RETRY_SECONDS = int(os.environ.get("MAIL_RETRY_SECONDS", 30))
+MAIL_LEASE_SECONDS = int(os.environ.get("MAIL_LEASE_SECONDS", 300))
+MAIL_POLL_SECONDS = float(os.environ.get("MAIL_POLL_SECONDS", 10))
+MAIL_IDLE_SECONDS = float(os.environ.get("MAIL_IDLE_SECONDS", 60))
+
+logger = logging.getLogger(__name__)
+
+_wake = threading.Event()
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def enqueue_mail(db, to_email, subject, html):
+    """Queues an HTML email, returns its id; it is sent by the mail worker"""
+    message_id = db.execute(
+        "INSERT INTO mail_queue (to_email, subject, body) VALUES (?, ?, ?)",
+        to_email, subject, html
+    )
+    _wake.set()
+    return message_id
+
+
+def build_message(to_email, subject, html, from_email=FROM_EMAIL):
+    """The MIME message of a queued email"""
+    message = MIMEMultipart()
+    message["From"] = from_email
+    message["To"] = to_email
+    message["Subject"] = subject
+    message.attach(MIMEText(html, "html"))
+    return message
+
+
+class Mailer:
+    """One SMTP connection, opened on first use and kept for the messages after it"""
+
+    def __init__(self, server=SMTP_SERVER, port=SMTP_PORT, username=SMTP_USERNAME, password=SMTP_PASSWORD,
+                 starttls=SMTP_STARTTLS, timeout=SMTP_TIMEOUT):
+        self.server = server
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self.connection = None
+        self.last_used = 0.0
+
+    def _connect(self):
+        connection = smtplib.SMTP(self.server, self.port, timeout=self.timeout)
+        try:
+            if self.starttls:
+                connection.starttls()
+            if self.username:
+                connection.login(self.username, self.password)
+        except BaseException:
+            connection.close()
+            raise
+        return connection
+
+    def send(self, message):
+        """Sends a message, connecting first if needed"""
+        if self.connection is None:
+            self.connection = self._connect()
+        try:
+            self.connection.send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            # The server dropped a connection we kept open: reconnect once
+            self.close()
+            self.connection = self._connect()
+            self.connection.send_message(message)
+        self.last_used = monotonic()
+
+    def idle(self):
+        """Seconds since the last message was sent over the open connection, None if there is none"""
+        if self.connection is None:
+            return None
+        return monotonic() - self.last_used
+
+    def close(self):
+        """Closes the connection, if open"""
+        if self.connection is None:
+            return
+        try:
+            self.connection.quit()
+        except (smtplib.SMTPException, OSError):
+            self.connection.close()
+        self.connection = None
+
+
+def _is_permanent(error):
+    """Check if the server rejected a message for good (5xx), so retrying can't help"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    return (
+        isinstance(error, smtplib.SMTPResponseException)
+        and not isinstance(error, smtplib.SMTPAuthenticationError)
+        and error.smtp_code >= 500
+    )
+
+
+def _retry_delay(attempts):
+    """Seconds to wait before the next attempt, after attempts failed ones"""
+    return MAIL_RETRY_SECONDS * 2 ** (attempts - 1)
+
+
+def claim_due_mail(db, limit=MAIL_BATCH_SIZE):
+    """Claims up to limit due messages for MAIL_LEASE_SECONDS and returns them, oldest first"""
+    with db.transaction("IMMEDIATE"):
+        messages = db.execute(
+            """
+            SELECT id, to_email, subject, body, attempts FROM mail_queue
+            WHERE status = 'pending' AND next_attempt_at <= datetime('now')
+            ORDER BY next_attempt_at, id
+            LIMIT ?
+            """,
+            limit
+        )
+        if messages:
+            db.execute(
+                f"""
+                UPDATE mail_queue SET next_attempt_at = datetime('now', ?)
+                WHERE id IN ({", ".join(["?"] * len(messages))})
+                """,
+                f"+{MAIL_LEASE_SECONDS} seconds", *[message["id"] for message in messages]
+            )
+    return messages
+
+
+def _failed(db, message, error, retry=True):
+    """Records a failed attempt: the message is tried again later or marked failed"""
+    attempts = message["attempts"] + 1
+    if retry and attempts < MAIL_MAX_ATTEMPTS:
+        db.execute(
+            """
+            UPDATE mail_queue SET attempts = ?, last_error = ?, next_attempt_at = datetime('now', ?)
+            WHERE id = ?
+            """,
+            attempts, str(error), f"+{_retry_delay(attempts)} seconds", message["id"]
+        )
+    else:
+        db.execute(
+            "UPDATE mail_queue SET status = 'failed', attempts = ?, last_error = ? WHERE id = ?",
+            attempts, str(error), message["id"]
+        )
+        logger.error("Giving up on email %s to %s: %s", message["id"], message["to_email"], error)
+
+
+def deliver_mail(db, mailer, limit=MAIL_BATCH_SIZE):
+    """Sends one batch of due messages over mailer, returns the number of messages claimed"""
+    messages = claim_due_mail(db, limit)
+
+    for i, message in enumerate(messages):
+        try:
+            mailer.send(build_message(message["to_email"], message["subject"], message["body"]))
+        except (smtplib.SMTPException, OSError) as e:
+            if _is_permanent(e):
+                _failed(db, message, e, retry=False)
+                continue
+
+            # The server can't be reached or misbehaves: the rest of the batch waits too
+            mailer.close()
+            logger.warning("Sending email %s failed: %s", message["id"], e)
+            for waiting in messages[i:]:
+                _failed(db, waiting, e)
+            break
+
+        db.execute("DELETE FROM mail_queue WHERE id = ?", message["id"])
+
+    return len(messages)
+
+
+def _run_worker(db, mailer):
+    """Mail worker loop: sends due mail, then sleeps until new mail is queued or MAIL_POLL_SECONDS pass"""
+    while True:
+        try:
+            claimed = deliver_mail(db, mailer)
+        except Exception:
+            logger.exception("Mail worker failed")
+            claimed = 0
+
+        # A full batch means more mail may be due right away
+        if claimed == MAIL_BATCH_SIZE:
+            continue
+
+        idle = mailer.idle()
+        if idle is not None and idle >= MAIL_IDLE_SECONDS:
+            mailer.close()
+
+        _wake.wait(MAIL_POLL_SECONDS)
+        _wake.clear()
+
+
+def start_mail_worker(db, mailer=None):
+    """Starts the mail worker thread of this process, once"""
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(
+                target=_run_worker, args=(db, mailer or Mailer()), name="mail-worker", daemon=True
+            )
+            _worker.start()
+    return _worker
@@ -0,0 +1,550 @@
+import ast
+import os
+
+from availability import refill_availability
+
+########################### Schema migrations ##################################
+
+# The schema version is kept in SQLite's PRAGMA user_version. Every migration below runs
+# once, in order, inside a transaction that also bumps user_version, so a database is
+# always at exactly one version. Migrations are never edited once released: changes to
+# the schema are a new function appended to MIGRATIONS.
+#
+# Migrations only use SQL, never app code, so they run the same on any later version of
+# the app. The availability table is computed from lessons and time requests by app code
+# that reads the latest schema, so migrate() refills it once, in the transaction of the
+# last migration, whenever any migration ran.
+#
+# The first migrations create the tables that used to be created on startup, with
+# IF NOT EXISTS, so databases that already have them are upgraded in place.
+
+
+def _availability(db):
+    """Materialized availability table (see availability.py)"""
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS availability (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            instructor_id INTEGER NOT NULL,
+            available_date DATE NOT NULL,
+            start_minute INTEGER NOT NULL,
+            end_minute INTEGER NOT NULL,
+            FOREIGN KEY (instructor_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """
+    )
+    db.execute("CREATE INDEX IF NOT EXISTS idx_availability_date_instructor ON availability(available_date, instructor_id)")
+
+
+def _lesson_settings(db):
+    """Lesson length settings (see lesson_settings.py)"""
+    db.execute(
+        """
+        CREATE TABLE IF NOT EXISTS lesson_settings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            instructor_id INTEGER UNIQUE,
+            duration INTEGER NOT NULL,
+            step INTEGER NOT NULL,
+            FOREIGN KEY (instructor_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """
+    )
+
+
+def _hot_query_indexes(db):
+    """Composite indexes for the queries the routes run most"""
+
+    # Lessons of an instructor on a day (booking checks, lesson index, calendars); the
+    # times make it covering for the overlap and availability queries
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_lessons_instructor_date "
+        "ON lessons(instructor_id, lesson_date, status, start_time, end_time)"
+    )
+
+    # Lessons of every instructor on a day or a range of days (schedule, availability)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_lessons_date_status ON lessons(lesson_date, status)")
+
+    # A customer's lessons
+    db.execute("CREATE INDEX IF NOT EXISTS idx_lessons_customer_date ON lessons(customer_id, lesson_date)")
+
+    # Requests of an instructor on a day, and approved/pending requests of a day or range of days;
+    # these replace the single column indexes on instructor_id and status
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_time_requests_instructor_date "
+        "ON time_requests(instructor_id, request_date, status)"
+    )
+    db.execute("CREATE INDEX IF NOT EXISTS idx_time_requests_status_date ON time_requests(status, request_date)")
+    db.execute("DROP INDEX IF EXISTS idx_time_requests_instructor")
+    db.execute("DROP INDEX IF EXISTS idx_time_requests_status")
+
+    # Admin schedules of a day, and of one admin
+    db.execute("CREATE INDEX IF NOT EXISTS idx_admin_schedules_date ON admin_schedules(work_date, admin_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_admin_schedules_admin_date ON admin_schedules(admin_id, work_date)")
+
+    # Users by role (instructor and customer lists)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_users_role ON users(role)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_user_info_role ON user_info(role, username)")
+
+    # Foreign keys without an index make SQLite read the whole child table whenever a user
+    # is added or deleted
+    db.execute("CREATE INDEX IF NOT EXISTS idx_availability_instructor ON availability(instructor_id)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_time_requests_admin ON time_requests(admin_id)")
+
+
+def _fix_delete_users_trigger(db):
+    """The trigger that deletes a user with their user_info referenced a table named user"""
+    db.execute("DROP TRIGGER IF EXISTS delete_users")
+    db.execute(
+        """
+        CREATE TRIGGER delete_users AFTER DELETE ON user_info
+        BEGIN
+            DELETE FROM users WHERE id = OLD.id;
+        END
+        """
+    )
+
+
+# Text to integer conversions for copying old rows: day numbers are days since 1970-01-01
+# (see days.py) and times are minutes since midnight
+def _day_sql(column):
+    return f"CAST(julianday({column}) - 2440587.5 AS INTEGER)"
+
+
+def _minute_sql(column):
+    return f"CAST(substr({column}, 1, 2) AS INTEGER) * 60 + CAST(substr({column}, 4, 2) AS INTEGER)"
+
+
+# The old text columns, derived from the integer ones for display
+def _date_column(name, day_column):
+    return f"{name} TEXT GENERATED ALWAYS AS (date({day_column} * 86400, 'unixepoch')) VIRTUAL"
+
+
+def _time_column(name, minute_column):
+    return f"{name} TEXT GENERATED ALWAYS AS (printf('%02d:%02d', {minute_column} / 60, {minute_column} % 60)) VIRTUAL"
+
+
+def _rebuild_table(db, table, create, columns, converted):
+    """Copies table into a new table made by create, with converted {column: expression} values"""
+    db.execute(create.format(table=f"{table}_new"))
+    db.execute(
+        f"INSERT INTO {table}_new ({', '.join(columns + list(converted))}) "
+        f"SELECT {', '.join(columns + list(converted.values()))} FROM {table}"
+    )
+
+    # Keep AUTOINCREMENT from reusing the ids of deleted rows
+    db.execute(
+        "UPDATE sqlite_sequence SET seq = (SELECT seq FROM sqlite_sequence WHERE name = ?) WHERE name = ?",
+        table, f"{table}_new"
+    )
+
+    # Nothing references these tables, so they can be dropped with foreign keys on
+    db.execute(f"DROP TABLE {table}")
+    db.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+
+def _integer_days_and_minutes(db):
+    """Lessons, time requests and admin schedules store day numbers and minutes since midnight"""
+
+    # The text columns (lesson_date, start_time, ...) stay readable as generated columns
+    # that take no space in the rows, so display code reads them as before while queries
+    # compare and sort the integer columns
+    _rebuild_table(
+        db, "lessons",
+        f"""
+        CREATE TABLE {{table}} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_id INTEGER NOT NULL,
+            instructor_id INTEGER NOT NULL,
+            lesson_day INTEGER NOT NULL,
+            start_minute INTEGER NOT NULL,
+            end_minute INTEGER NOT NULL,
+            status TEXT CHECK(status IN ('booked', 'completed', 'cancelled', 'no-show')) DEFAULT 'booked',
+            notes TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            {_date_column("lesson_date", "lesson_day")},
+            {_time_column("start_time", "start_minute")},
+            {_time_column("end_time", "end_minute")},
+            FOREIGN KEY (customer_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (instructor_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """,
+        ["id", "customer_id", "instructor_id", "status", "notes", "created_at"],
+        {
+            "lesson_day": _day_sql("lesson_date"),
+            "start_minute": _minute_sql("start_time"),
+            "end_minute": _minute_sql("end_time")
+        }
+    )
+    db.execute(
+        "CREATE INDEX idx_lessons_instructor_date "
+        "ON lessons(instructor_id, lesson_day, status, start_minute, end_minute)"
+    )
+    db.execute("CREATE INDEX idx_lessons_date_status ON lessons(lesson_day, status)")
+    db.execute("CREATE INDEX idx_lessons_customer_date ON lessons(customer_id, lesson_day)")
+
+    _rebuild_table(
+        db, "time_requests",
+        f"""
+        CREATE TABLE {{table}} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            instructor_id INTEGER NOT NULL,
+            request_day INTEGER NOT NULL,
+            start_minute INTEGER NOT NULL,
+            end_minute INTEGER NOT NULL,
+            request_type TEXT NOT NULL CHECK(request_type IN ('open', 'close')),
+            status TEXT DEFAULT 'pending' CHECK(status IN ('pending', 'approved', 'rejected')),
+            reason TEXT,
+            admin_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            processed_at TIMESTAMP,
+            admin_note TEXT,
+            {_date_column("request_date", "request_day")},
+            {_time_column("start_time", "start_minute")},
+            {_time_column("end_time", "end_minute")},
+            FOREIGN KEY (admin_id) REFERENCES users(id) ON DELETE SET NULL,
+            FOREIGN KEY (instructor_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """,
+        [
+            "id", "instructor_id", "request_type", "status", "reason", "admin_id",
+            "created_at", "processed_at", "admin_note"
+        ],
+        {
+            "request_day": _day_sql("request_date"),
+            "start_minute": _minute_sql("start_time"),
+            "end_minute": _minute_sql("end_time")
+        }
+    )
+    db.execute(
+        "CREATE INDEX idx_time_requests_instructor_date "
+        "ON time_requests(instructor_id, request_day, status)"
+    )
+    db.execute("CREATE INDEX idx_time_requests_status_date ON time_requests(status, request_day)")
+    db.execute("CREATE INDEX idx_time_requests_admin ON time_requests(admin_id)")
+
+    _rebuild_table(
+        db, "admin_schedules",
+        f"""
+        CREATE TABLE {{table}} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER NOT NULL,
+            work_day INTEGER NOT NULL,
+            start_minute INTEGER NOT NULL,
+            end_minute INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            {_date_column("work_date", "work_day")},
+            {_time_column("start_time", "start_minute")},
+            {_time_column("end_time", "end_minute")},
+            FOREIGN KEY (admin_id) REFERENCES users(id)
+        )
+        """,
+        ["id", "admin_id", "created_at", "updated_at"],
+        {
+            "work_day": _day_sql("work_date"),
+            "start_minute": _minute_sql("start_time"),
+            "end_minute": _minute_sql("end_time")
+        }
+    )
+    db.execute("CREATE INDEX idx_admin_schedules_date ON admin_schedules(work_day, admin_id)")
+    db.execute("CREATE INDEX idx_admin_schedules_admin_date ON admin_schedules(admin_id, work_day)")
+
+
+def _lessons_no_overlap(db):
+    """Booked lessons of an instructor can't overlap (see booking.py)"""
+
+    # Checked with the (instructor_id, lesson_day, status, start_minute, end_minute) index;
+    # the message is matched by booking.OVERLAP_ERROR
+    for name, event in [
+        ("lessons_no_overlap_insert", "INSERT"),
+        ("lessons_no_overlap_update", "UPDATE OF instructor_id, lesson_day, start_minute, end_minute, status")
+    ]:
+        db.execute(
+            f"""
+            CREATE TRIGGER {name} BEFORE {event} ON lessons
+            WHEN NEW.status = 'booked'
+            BEGIN
+                SELECT RAISE(ABORT, 'lesson overlaps a booked lesson')
+                WHERE EXISTS (
+                    SELECT 1 FROM lessons
+                    WHERE instructor_id = NEW.instructor_id
+                    AND lesson_day = NEW.lesson_day
+                    AND status = 'booked'
+                    AND start_minute < NEW.end_minute
+                    AND end_minute > NEW.start_minute
+                    AND id IS NOT NEW.id
+                );
+            END
+            """
+        )
+
+
+def _user_search(db):
+    """Trigram full-text index of user names, emails and phones (see user_search.py)"""
+
+    # External content table: the text stays in user_info and the triggers keep the index
+    # in step with it. FTS5 removes a row from the index by the values it was indexed with,
+    # so delete and update pass the OLD values.
+    indexed = ["username", "name", "surname", "email", "phone"]
+    columns = ", ".join(indexed)
+    new_values = ", ".join(f"NEW.{column}" for column in indexed)
+    old_values = ", ".join(f"OLD.{column}" for column in indexed)
+
+    db.execute(
+        f"""
+        CREATE VIRTUAL TABLE user_search USING fts5(
+            {columns}, content = 'user_info', content_rowid = 'id', tokenize = 'trigram'
+        )
+        """
+    )
+    db.execute(
+        f"""
+        CREATE TRIGGER user_search_insert AFTER INSERT ON user_info
+        BEGIN
+            INSERT INTO user_search (rowid, {columns}) VALUES (NEW.id, {new_values});
+        END
+        """
+    )
+    db.execute(
+        f"""
+        CREATE TRIGGER user_search_delete AFTER DELETE ON user_info
+        BEGIN
+            INSERT INTO user_search (user_search, rowid, {columns}) VALUES ('delete', OLD.id, {old_values});
+        END
+        """
+    )
+    db.execute(
+        f"""
+        CREATE TRIGGER user_search_update AFTER UPDATE OF {columns} ON user_info
+        BEGIN
+            INSERT INTO user_search (user_search, rowid, {columns}) VALUES ('delete', OLD.id, {old_values});
+            INSERT INTO user_search (rowid, {columns}) VALUES (NEW.id, {new_values});
+        END
+        """
+    )
+    db.execute("INSERT INTO user_search (user_search) VALUES ('rebuild')")
+
+
+def _mail_queue(db):
+    """Outgoing mail queue (see mail_queue.py)"""
+    db.execute(
+        """
+        CREATE TABLE mail_queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            to_email TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending' CHECK(status IN ('pending', 'failed')),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    db.execute("CREATE INDEX idx_mail_queue_due ON mail_queue(status, next_attempt_at)")
+
+
+def _sessions(db):
+    """Server-side sessions (see session_store.py)"""
+    db.execute(
+        """
+        CREATE TABLE sessions (
+            id TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            expires_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """
+    )
+    db.execute("CREATE INDEX idx_sessions_expires ON sessions(expires_at)")
+
+
+def _integer_availability_days(db):
+    """Availability stores day numbers"""
+
+    # The table only holds what refill_availability computes from lessons and time
+    # requests, so it is made again empty (migrate() refills it) instead of converted. The
+    # text date stays readable as a generated column, like in _integer_days_and_minutes.
+    db.execute("DROP TABLE availability")
+    db.execute(
+        f"""
+        CREATE TABLE availability (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            instructor_id INTEGER NOT NULL,
+            available_day INTEGER NOT NULL,
+            start_minute INTEGER NOT NULL,
+            end_minute INTEGER NOT NULL,
+            {_date_column("available_date", "available_day")},
+            FOREIGN KEY (instructor_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """
+    )
+
+    # Covering for the range reads, which need only these columns
+    db.execute(
+        "CREATE INDEX idx_availability_day_instructor "
+        "ON availability(available_day, instructor_id, start_minute, end_minute)"
+    )
+    db.execute("CREATE INDEX idx_availability_instructor ON availability(instructor_id)")
+
+
+MIGRATIONS = [
+    _availability,
+    _lesson_settings,
+    _hot_query_indexes,
+    _fix_delete_users_trigger,
+    _integer_days_and_minutes,
+    _lessons_no_overlap,
+    _user_search,
+    _mail_queue,
+    _sessions,
+    _integer_availability_days
+]
+
+
+def schema_version(db):
+    """Returns the version the database is at"""
+    return db.execute("PRAGMA user_version")[0]["user_version"]
+
+
+def migrate(db):
+    """Runs every migration the database doesn't have yet, returns the descriptions of the ones run"""
+    applied = []
+
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        if schema_version(db) >= version:
+            continue
+
+        # BEGIN IMMEDIATE so two processes starting together don't both run it
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            if schema_version(db) < version:
+                migration(db)
+                db.execute(f"PRAGMA user_version = {version}")
+                applied.append(f"{version}: {migration.__doc__}")
+
+                # The schema is now the one the app code reads
+                if version == len(MIGRATIONS):
+                    refill_availability(db)
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+
+    return applied
+
+
+########################### Query plan check ##################################
+
+# Every query the app sends is checked with EXPLAIN QUERY PLAN, and any query that reads
+# a whole table instead of searching an index is reported. Queries are collected from the
+# db.execute calls in the source. The {...} parts of f-strings are either optional filters
+# or lists of values, so each query is tried with them left out and with a ? in their
+# place; queries that can't be prepared either way (e.g. multi-row VALUES lists) are
+# reported as skipped. A DELETE without WHERE is meant to empty the table.
+
+SOURCE_FILES = [
+    "app.py",
+    "availability.py",
+    "booking.py",
+    "lesson_settings.py",
+    "mail_queue.py",
+    "session_store.py",
+    "time_requests.py",
+    "user_search.py",
+    "working_hours.py",
+    "blueprints/admin.py",
+    "blueprints/customer.py",
+    "blueprints/instructor.py",
+    "blueprints/owner.py"
+]
+
+# Tables that may be read whole, and why
+ALLOWED_SCANS = {
+    "working_hours": "one row per day of the week",
+    "lesson_settings": "one row per instructor with their own setting",
+    "sqlite_master": "schema lookups"
+}
+
+
+def _query_texts(node):
+    """SQL texts to try for a string or f-string node, [] for anything else"""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return [node.value]
+    if isinstance(node, ast.JoinedStr):
+        return [
+            "".join(part.value if isinstance(part, ast.Constant) else placeholder for part in node.values)
+            for placeholder in ("", "?")
+        ]
+    return []
+
+
+def source_queries(root):
+    """Yields (location, [sql variants]) for every db.execute call with a literal query"""
+    for path in SOURCE_FILES:
+        with open(os.path.join(root, path)) as file:
+            tree = ast.parse(file.read(), path)
+
+        for node in ast.walk(tree):
+            if (
+                isinstance(node, ast.Call)
+                and isinstance(node.func, ast.Attribute)
+                and node.func.attr == "execute"
+                and isinstance(node.func.value, ast.Name)
+                and node.func.value.id == "db"
+                and node.args
+            ):
+                variants = _query_texts(node.args[0])
+                if variants:
+                    yield f"{path}:{node.lineno}", variants
+
+
+def check_query_plans(db, root="."):
+    """Returns ([(location, plan detail)] of full table scans, [(location, error)] of skipped queries)"""
+    scans = []
+    skipped = []
+
+    for location, variants in source_queries(root):
+        command = variants[0].lstrip()[:8].split(None, 1)[0].upper()
+        if command not in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH"):
+            continue
+        if command == "DELETE" and "WHERE" not in variants[0].upper():
+            continue
+
+        # The first variant that can be prepared and doesn't scan, or else the first that can be prepared
+        variant_scans = None
+        error = None
+        for sql in variants:
+            try:
+                plan = db.execute(f"EXPLAIN QUERY PLAN {sql}", *([None] * sql.count("?")))
+            except Exception as e:
+                error = error or str(e)
+                continue
+
+            found = [step["detail"] for step in plan if _is_table_scan(step["detail"])]
+            if variant_scans is None or not found:
+                variant_scans = found
+            if not found:
+                break
+
+        if variant_scans is None:
+            skipped.append((location, error))
+        else:
+            scans += [(location, detail) for detail in variant_scans]
+
+    return scans, skipped
+
+
+def _is_table_scan(detail):
+    """Check if a query plan step reads a whole table that isn't allowed to be read whole"""
+    words = detail.split()
+    if len(words) < 2 or words[0] != "SCAN":
+        return False
+
+    # A virtual table (full-text index) is searched when it was given constraints, e.g.
+    # "SCAN user_search VIRTUAL TABLE INDEX 0:M2" for a MATCH, and read whole for "INDEX 0:"
+    if "VIRTUAL TABLE INDEX" in detail:
+        return detail.endswith(":")
+
+    # "SCAN CONSTANT ROW" and scans of subquery results don't read a table
+    return words[1] not in ALLOWED_SCANS and words[1] not in ("CONSTANT", "(subquery")
@@ -0,0 +1,73 @@
+from collections import Counter
+import os
+import re
+import threading
+
+########################### Per-request query statistics ##################################
+
+# While a request is handled, every statement the Database runs on that thread is
+# counted and timed (see Database.on_query). At the end of the request app.py writes a
+# summary to the X-Query-Stats response header and the debug log, and warns when one
+# statement ran more than REPEAT_THRESHOLD times, which usually means a query in a
+# loop that could be one query for the whole loop.
+
+REPEAT_THRESHOLD = int(os.environ.get("QUERY_REPEAT_THRESHOLD", 10))
+
+_local = threading.local()
+
+
+class QueryStats:
+    """Queries run while handling one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.shapes = Counter()
+
+    def add(self, sql, seconds):
+        self.count += 1
+        self.total_time += seconds
+        self.max_time = max(self.max_time, seconds)
+        self.shapes[query_shape(sql)] += 1
+
+    def repeated(self, threshold=REPEAT_THRESHOLD):
+        """Returns [(shape, count)] of the statements that ran more than threshold times, most first"""
+        return [(shape, count) for shape, count in self.shapes.most_common() if count > threshold]
+
+    def header(self):
+        """Summary for the X-Query-Stats response header"""
+        return (
+            f"count={self.count}; total_ms={self.total_time * 1000:.2f}; "
+            f"max_ms={self.max_time * 1000:.2f}; distinct={len(self.shapes)}"
+        )
+
+
+def query_shape(sql):
+    """The statement with whitespace collapsed and lists of ? shortened, so the same query always has the same shape"""
+    shape = " ".join(sql.split())
+    return re.sub(r"\?(\s*,\s*\?)+", "?, ...", shape)
+
+
+def start_query_stats():
+    """Starts collecting the queries of the current thread"""
+    _local.stats = QueryStats()
+
+
+def current_query_stats():
+    """Returns the QueryStats being collected on the current thread, or None"""
+    return getattr(_local, "stats", None)
+
+
+def stop_query_stats():
+    """Stops collecting and returns what was collected (None if nothing was)"""
+    stats = current_query_stats()
+    _local.stats = None
+    return stats
+
+
+def record_query(sql, seconds):
+    """Database.on_query hook: adds a statement to the current thread's stats, if any"""
+    stats = current_query_stats()
+    if stats is not None:
+        stats.add(sql, seconds)
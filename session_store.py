@@ -0,0 +1,138 @@
+import os
+import secrets
+import threading
+from time import monotonic, time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+########################### Server-side sessions ##################################
+
+# Sessions are rows of the sessions table (see migrations.py): the cookie holds only a
+# random session id, the row holds the session serialized like Flask's own cookie
+# sessions (TaggedJSONSerializer, so tuples, dates and Markup survive) and its expiry in
+# Unix seconds, indexed.
+#
+# A request writes its session only when it changed, or when its expiry has less than
+# half of PERMANENT_SESSION_LIFETIME left, so most requests don't write at all. Expired
+# sessions are deleted SESSION_GC_BATCH rows at a time, at most once every
+# SESSION_GC_INTERVAL seconds per process, by whichever request comes along, or all at
+# once with `flask prune-sessions`.
+
+SESSION_GC_INTERVAL = float(os.environ.get("SESSION_GC_INTERVAL", 300))
+SESSION_GC_BATCH = int(os.environ.get("SESSION_GC_BATCH", 500))
+
+
+class SqliteSession(CallbackDict, SessionMixin):
+    """Session data of one request; any change sets modified"""
+
+    def __init__(self, initial=None, sid=None, expires_at=None, new=False):
+        def on_update(session):
+            session.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.new = new
+        self.modified = False
+
+
+def prune_sessions(db, now=None, batch_size=SESSION_GC_BATCH):
+    """Deletes up to batch_size expired sessions, returns how many were deleted"""
+    return db.execute(
+        """
+        DELETE FROM sessions WHERE id IN (
+            SELECT id FROM sessions WHERE expires_at <= ? LIMIT ?
+        )
+        """,
+        int(now or time()), batch_size
+    )
+
+
+class SqliteSessionInterface(SessionInterface):
+    """Keeps sessions in the sessions table of db"""
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, db, gc_interval=SESSION_GC_INTERVAL, gc_batch=SESSION_GC_BATCH):
+        self.db = db
+        self.gc_interval = gc_interval
+        self.gc_batch = gc_batch
+        self._last_gc = monotonic()
+        self._gc_lock = threading.Lock()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            rows = self.db.execute(
+                "SELECT data, expires_at FROM sessions WHERE id = ? AND expires_at > ?",
+                sid, int(time())
+            )
+            if rows:
+                return SqliteSession(self.serializer.loads(rows[0]["data"]), sid, rows[0]["expires_at"])
+
+        # Unknown and expired ids aren't reused, so a client can't choose its session id
+        return SqliteSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        self._collect_garbage()
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        # An emptied session is deleted with its cookie, an empty new one is never stored
+        if not session:
+            if session.modified and not session.new:
+                self.db.execute("DELETE FROM sessions WHERE id = ?", session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure, samesite=samesite,
+                                       httponly=httponly)
+                response.vary.add("Cookie")
+            return
+
+        now = int(time())
+        lifetime = int(app.permanent_session_lifetime.total_seconds())
+        if session.modified:
+            self.db.execute(
+                """
+                INSERT INTO sessions (id, data, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT (id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at
+                """,
+                session.sid, self.serializer.dumps(dict(session)), now + lifetime
+            )
+        elif session.expires_at - now < lifetime // 2:
+            self.db.execute("UPDATE sessions SET expires_at = ? WHERE id = ?", now + lifetime, session.sid)
+
+        if not self.should_set_cookie(app, session):
+            return
+
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=httponly,
+            domain=domain,
+            path=path,
+            secure=secure,
+            samesite=samesite
+        )
+        response.vary.add("Cookie")
+
+    def _collect_garbage(self):
+        """Deletes one batch of expired sessions when SESSION_GC_INTERVAL has passed since the last one"""
+        if monotonic() - self._last_gc < self.gc_interval:
+            return
+        if not self._gc_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_gc = monotonic()
+            prune_sessions(self.db, batch_size=self.gc_batch)
+        finally:
+            self._gc_lock.release()
@@ -0,0 +1,87 @@
+from availability import invalidate_availability, refresh_availability_days
+from days import to_day
+
+########################### Bulk processing of time requests ##################################
+
+# Admins approve or reject many pending time requests at once, picked by id or by a
+# filter (instructor, dates, type). The batch is one transaction: every request gets the
+# same processed_at and ties are broken by id wherever requests are replayed
+# (ORDER BY processed_at, id), so a batch is applied in the order the requests were made.
+# The stored availability of each affected instructor day is recomputed once and its
+# cache invalidated once, after the commit.
+
+def _pending_filter(request_ids=None, instructor_id=None, first_date=None, last_date=None, request_type=None):
+    """Returns (SQL conditions after status = 'pending', args)"""
+    conditions = []
+    args = []
+
+    if request_ids is not None:
+        conditions.append(f"AND id IN ({', '.join(['?'] * len(request_ids))})")
+        args += request_ids
+    if instructor_id:
+        conditions.append("AND instructor_id = ?")
+        args.append(instructor_id)
+    if first_date:
+        conditions.append("AND request_day >= ?")
+        args.append(to_day(first_date))
+    if last_date:
+        conditions.append("AND request_day <= ?")
+        args.append(to_day(last_date))
+    if request_type:
+        conditions.append("AND request_type = ?")
+        args.append(request_type)
+
+    return " ".join(conditions), args
+
+
+def has_selection(request_ids=None, instructor_id=None, first_date=None, last_date=None, request_type=None):
+    """Check if ids or at least one filter value pick the requests to process"""
+    return bool(request_ids or instructor_id or first_date or last_date or request_type)
+
+
+def process_time_requests(db, status, admin_id, admin_note="", request_ids=None, instructor_id=None,
+                          first_date=None, last_date=None, request_type=None, process_all=False):
+    """Sets status ('approved' or 'rejected') on the pending requests picked by ids or by the filter
+
+    Returns the number of requests processed. Empty filter values are ignored; with no ids
+    and no filter every pending request is processed, but only when process_all is set,
+    otherwise ValueError is raised.
+    """
+    if request_ids is not None and not request_ids:
+        return 0
+    if not process_all and not has_selection(request_ids, instructor_id, first_date, last_date, request_type):
+        raise ValueError("No time requests selected")
+
+    conditions, args = _pending_filter(request_ids, instructor_id, first_date, last_date, request_type)
+
+    with db.transaction("IMMEDIATE"):
+        requests = db.execute(
+            f"""
+            SELECT id, instructor_id, request_date FROM time_requests
+            WHERE status = 'pending' {conditions}
+            """,
+            *args
+        )
+        if not requests:
+            return 0
+
+        # The same conditions pick the same rows while the transaction holds the write lock
+        db.execute(
+            f"""
+            UPDATE time_requests
+            SET status = ?, admin_id = ?, processed_at = CURRENT_TIMESTAMP, admin_note = ?
+            WHERE status = 'pending' {conditions}
+            """,
+            status, admin_id, admin_note, *args
+        )
+
+        # Rejected requests never counted, approved ones change the instructor's days
+        days = set()
+        if status == "approved":
+            days = {(req["instructor_id"], req["request_date"]) for req in requests}
+            refresh_availability_days(db, days)
+
+    for instructor_id, date in days:
+        invalidate_availability(instructor_id, date)
+
+    return len(requests)
@@ -0,0 +1,29 @@
+import os
+
+from cache import VersionedLRUCache
+
+########################### Logged-in user cache ##################################
+
+# Flask-Login loads the user of every authenticated request, calendar polls included.
+# The User objects are cached per id for USER_CACHE_TTL seconds. Routes that change what
+# a User holds or whether it may log in (role changes, deleted users, new passwords)
+# call invalidate_user(), so this process sees the change at once; other processes see
+# it when the entry expires.
+
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 1024))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", 60))
+
+user_cache = VersionedLRUCache(max_entries=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+
+def cached_user(user_id, load):
+    """Returns the cached user of user_id (an int), calling load() on a miss (None when there is no such user)"""
+    return user_cache.get_or_compute(user_id, load)
+
+
+def invalidate_user(user_id):
+    """Drops the cached user of user_id"""
+    try:
+        user_cache.invalidate(int(user_id))
+    except (ValueError, TypeError):
+        pass
@@ -0,0 +1,78 @@
+########################### User search ##################################
+
+# Users are searched in the user_search table, an FTS5 index of user_info with the
+# trigram tokenizer (see migrations.py), kept up to date by triggers on user_info. A
+# trigram index finds any substring of 3 or more characters, case-insensitively, like
+# LIKE '%...%' did, but without reading every user. Each word of the query that is 3 or
+# more characters long must be found in one of the searched columns, and results are
+# ranked by bm25 (rarer and more complete matches first).
+#
+# Queries shorter than 3 characters can't be looked up by trigrams; they are matched with
+# LIKE on the index, which reads it whole, so autocomplete should wait for 3 characters.
+
+MIN_TERM_LENGTH = 3
+
+# Columns of the user_search table
+SEARCH_COLUMNS = ["username", "name", "surname", "email", "phone"]
+
+
+def match_query(query, columns=SEARCH_COLUMNS):
+    """FTS5 query that finds every word of query (of 3+ characters) in columns, None if there is no such word"""
+    terms = [term for term in query.split() if len(term) >= MIN_TERM_LENGTH]
+    if not terms:
+        return None
+
+    # Quoted, so characters like @, + and - in emails and phones are text, not query syntax
+    phrases = " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+    return f"{{{' '.join(columns)}}} : ({phrases})"
+
+
+def _like_pattern(query):
+    """LIKE pattern that finds query anywhere, with % and _ in it taken literally"""
+    escaped = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def search_users(db, query, roles, columns=SEARCH_COLUMNS, limit=-1):
+    """Returns the ids of the users with one of roles whose columns contain query, best match first
+
+    limit=-1 returns every match.
+    """
+    query = query.strip()
+    if not query or not roles:
+        return []
+
+    placeholders = ", ".join(["?"] * len(roles))
+    match = match_query(query, columns)
+
+    if match:
+        rows = db.execute(
+            f"""
+            SELECT user_search.rowid AS id FROM user_search
+            JOIN users ON users.id = user_search.rowid
+            WHERE user_search MATCH ? AND users.role IN ({placeholders})
+            ORDER BY bm25(user_search), user_search.surname, user_search.name
+            LIMIT ?
+            """,
+            match, *roles, limit
+        )
+    else:
+        conditions = " OR ".join(f"user_search.{column} LIKE ? ESCAPE '\\'" for column in columns)
+        rows = db.execute(
+            f"""
+            SELECT user_search.rowid AS id FROM user_search
+            JOIN users ON users.id = user_search.rowid
+            WHERE ({conditions}) AND users.role IN ({placeholders})
+            ORDER BY user_search.surname, user_search.name
+            LIMIT ?
+            """,
+            *[_like_pattern(query)] * len(columns), *roles, limit
+        )
+
+    return [row["id"] for row in rows]
+
+
+def in_rank_order(rows, ids):
+    """Sorts rows (dicts with an "id") into the order of ids"""
+    position = {user_id: i for i, user_id in enumerate(ids)}
+    return sorted(rows, key=lambda row: position[row["id"]])
@@ -0,0 +1,101 @@
+from collections import namedtuple
+import os
+
+from cache import VersionedLRUCache
+from intervals import to_minutes
+
+########################### School working hours ##################################
+
+# The working_hours table has at most one row per day of the week and changes only when
+# the owner saves it, so it is read once and kept as an immutable WorkingHours snapshot
+# until owner_working_hours calls invalidate_working_hours(). Like the other caches the
+# snapshot lives in the app process, so it is also read again after WORKING_HOURS_TTL
+# seconds for hours saved by another process.
+#
+# Pages and JSON endpoints have always shown the hours in two shapes, kept as they were:
+# hours_by_day() has every day, with its name and 09:00-17:00 open for days that aren't
+# in the table, and configured_hours() has only the days in the table, without names.
+
+DAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+DEFAULT_OPEN_TIME = "09:00"
+DEFAULT_CLOSE_TIME = "17:00"
+
+WORKING_HOURS_TTL = float(os.environ.get("WORKING_HOURS_TTL", 30))
+
+# One day of the week; open_minute and close_minute are open_time and close_time in minutes
+DayHours = namedtuple(
+    "DayHours",
+    ["day", "name", "open_time", "close_time", "is_open", "configured", "open_minute", "close_minute"]
+)
+
+
+class WorkingHours:
+    """Snapshot of the working hours, indexed by day of the week (0 = Monday)"""
+
+    def __init__(self, rows):
+        by_day = {row["day_of_week"]: row for row in rows}
+
+        days = []
+        for day, name in enumerate(DAY_NAMES):
+            row = by_day.get(day)
+            if row is None:
+                days.append(DayHours(
+                    day, name, DEFAULT_OPEN_TIME, DEFAULT_CLOSE_TIME, True, False,
+                    to_minutes(DEFAULT_OPEN_TIME), to_minutes(DEFAULT_CLOSE_TIME)
+                ))
+            else:
+                days.append(DayHours(
+                    day, name, row["open_time"], row["close_time"], row["is_open"], True,
+                    to_minutes(row["open_time"]), to_minutes(row["close_time"])
+                ))
+        self.days = tuple(days)
+
+    def on_date(self, date):
+        """DayHours of the day of the week of date"""
+        return self.days[date.weekday()]
+
+    def open_minutes(self, date):
+        """(open, close) in minutes on date when the table has the school open that day, else None"""
+        hours = self.days[date.weekday()]
+        if not hours.configured or hours.is_open != 1:
+            return None
+        return hours.open_minute, hours.close_minute
+
+    def hours_by_day(self):
+        """{day: {name, open_time, close_time, is_open}} for every day, for templates"""
+        return {
+            hours.day: {
+                "name": hours.name,
+                "open_time": hours.open_time,
+                "close_time": hours.close_time,
+                "is_open": hours.is_open
+            }
+            for hours in self.days
+        }
+
+    def configured_hours(self):
+        """{day: {open_time, close_time, is_open}} for the days in the table, for JSON responses"""
+        return {
+            hours.day: {
+                "open_time": hours.open_time,
+                "close_time": hours.close_time,
+                "is_open": hours.is_open
+            }
+            for hours in self.days if hours.configured
+        }
+
+
+# One entry; the cache makes sure a snapshot read while the owner saves isn't kept
+_snapshot_cache = VersionedLRUCache(max_entries=1, ttl=WORKING_HOURS_TTL)
+
+
+def get_working_hours(db):
+    """Returns the current WorkingHours snapshot, reading the table if needed"""
+    return _snapshot_cache.get_or_compute("working_hours", lambda: WorkingHours(db.execute(
+        "SELECT day_of_week, open_time, close_time, is_open FROM working_hours ORDER BY day_of_week"
+    )))
+
+
+def invalidate_working_hours():
+    """Makes the next get_working_hours() read the table again"""
+    _snapshot_cache.invalidate("working_hours")